@@ -0,0 +1,54 @@
+"""
+Work tree scan benchmark: `git status --porcelain` vs scripts/git_index.py
+(mmap'd index + threaded lstat) on synthetic repositories of 10k, 100k and
+500k tracked files. Both are timed as whole processes, the way the git
+segment runs them.
+
+    python bench/bench_git_index.py [files,files,...] [runs]
+"""
+from __future__ import annotations
+
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+from common import ROOT, report
+from repos import make_repo
+
+GIT_INDEX = ROOT / "scripts" / "git_index.py"
+
+
+def time_command(argv: List[str], runs: int) -> List[float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, check=True, stdout=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main() -> int:
+    sizes = [int(n) for n in sys.argv[1].split(",")] if len(sys.argv) > 1 else [10_000, 100_000, 500_000]
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    for files in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo = make_repo(pathlib.Path(tmp) / "repo", files)
+            # Let git refresh the index once so neither side pays for racy entries
+            subprocess.run(["git", "-C", str(repo), "status"], check=True, stdout=subprocess.DEVNULL)
+            undecided = subprocess.run(
+                [sys.executable, str(GIT_INDEX), "--root", str(repo), "--no-fallback"],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split("undecided=")[-1].strip()
+            print(f"repository: {files} tracked files, {undecided} undecided by stat")
+            report("git status --porcelain", time_command(["git", "-C", str(repo), "status", "--porcelain"], runs))
+            report("git_index.py", time_command([sys.executable, str(GIT_INDEX), "--root", str(repo)], runs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
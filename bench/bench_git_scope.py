@@ -0,0 +1,43 @@
+"""
+Scoped git status benchmark on a synthetic monorepo: files spread over
+services/svcNN (each with a pyproject.toml), timed from inside one service
+with git.scope = repo, project and cwd.
+
+    python bench/bench_git_scope.py [files] [services] [runs]
+"""
+from __future__ import annotations
+
+import pathlib
+import sys
+import tempfile
+
+from common import report, require_zsh, time_block
+from repos import git, make_repo
+
+
+def main() -> int:
+    require_zsh()
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    services = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    subdirs = [f"services/svc{i:02d}" for i in range(services)]
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = make_repo(pathlib.Path(tmp) / "repo", files, subdirs=subdirs)
+        for subdir in subdirs:
+            (repo / subdir / "pyproject.toml").write_text("[project]\n", encoding="utf-8")
+        git(repo, "add", "-A")
+        git(repo, "commit", "-q", "-m", "markers")
+        workdir = repo / subdirs[0] / "d0000"
+        print(f"monorepo: {files} tracked files in {services} services, cwd {workdir.relative_to(repo)}")
+        for scope in ("repo", "project", "cwd"):
+            setup = (
+                f'source "$ZPE_SCRIPT"\nzpe_register_default_modules\n'
+                f"ZPE_GIT_CONF[cache_max_age]=0\nZPE_GIT_CONF[scope]={scope}\n"
+                f"cd {workdir}\ngit status >/dev/null"
+            )
+            report(f"scope={scope}", time_block(setup, "zpe_module_git", runs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,50 @@
+"""
+Git segment benchmark on a synthetic repository (default 50k tracked files):
+the previous rev-parse + symbolic-ref + `status --porcelain` + read-loop
+pipeline vs the single `status --porcelain=v2 --branch -z` call.
+
+    python bench/bench_git_status.py [files] [runs]
+"""
+from __future__ import annotations
+
+import pathlib
+import sys
+import tempfile
+
+from common import report, require_zsh, time_block
+from repos import make_repo
+
+LEGACY = r"""
+function legacy_git_segment() {
+  git rev-parse --is-inside-work-tree >/dev/null 2>&1 || return
+  local branch
+  branch=$(git symbolic-ref --quiet --short HEAD 2>/dev/null || git rev-parse --short HEAD 2>/dev/null)
+  local out line added=0 modified=0 deleted=0
+  out=$(git status --porcelain 2>/dev/null)
+  while IFS= read -r line; do
+    case ${line[1,1]}${line[2,2]} in
+      M*|*M) ((modified++));;
+      A*|*A) ((added++));;
+      D*|*D) ((deleted++));;
+    esac
+  done <<< "$out"
+  REPLY="git:${branch} +${added} ~${modified} -${deleted}"
+}
+"""
+
+
+def main() -> int:
+    require_zsh()
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = make_repo(pathlib.Path(tmp) / "repo", files)
+        setup = f'source "$ZPE_SCRIPT"\nzpe_register_default_modules\n{LEGACY}\ncd {repo}\ngit status >/dev/null'
+        print(f"repository: {files} tracked files")
+        report("legacy (3-4 git calls)", time_block(setup, "legacy_git_segment", runs))
+        report("porcelain v2 (1 git call)", time_block(setup, "zpe_module_git", runs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
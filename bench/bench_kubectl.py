@@ -0,0 +1,75 @@
+"""
+kubectl segment benchmark on a large, multi-file kubeconfig: several files
+of clusters with certificate data (a few MB in total), the current context
+and its namespace defined in the last file. Times a cold read (signature
+changed), a cached prompt, and `kubectl config` itself when it is installed.
+
+    python bench/bench_kubectl.py [files] [clusters-per-file] [runs]
+"""
+from __future__ import annotations
+
+import base64
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+from typing import List
+
+from common import report, require_zsh, time_block
+
+
+def write_kubeconfig(path: pathlib.Path, index: int, clusters: int, current: str) -> None:
+    cert = base64.b64encode(os.urandom(3000)).decode("ascii")
+    lines: List[str] = ["apiVersion: v1", "kind: Config", "clusters:"]
+    for i in range(clusters):
+        lines += [
+            "- cluster:",
+            f"    certificate-authority-data: {cert}",
+            f"    server: https://c{index}-{i}.example.com:6443",
+            f"  name: c{index}-{i}",
+        ]
+    lines.append("contexts:")
+    for i in range(clusters):
+        lines += [
+            "- context:",
+            f"    cluster: c{index}-{i}",
+            f"    user: u{index}-{i}",
+            f"    namespace: ns-{index}-{i}",
+            f"  name: ctx-{index}-{i}",
+        ]
+    if current:
+        lines.append(f"current-context: {current}")
+    lines += ["preferences: {}", "users:"]
+    for i in range(clusters):
+        lines += ["- name: u{0}-{1}".format(index, i), "  user:", f"    token: {cert[:64]}"]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def main() -> int:
+    require_zsh()
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    clusters = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [pathlib.Path(tmp) / f"config-{i}" for i in range(files)]
+        last = files - 1
+        for i, path in enumerate(paths):
+            write_kubeconfig(path, i, clusters, f"ctx-{last}-{clusters - 1}" if i == 0 else "")
+        total = sum(path.stat().st_size for path in paths)
+        env = {"KUBECONFIG": ":".join(str(path) for path in paths)}
+        print(f"kubeconfig: {files} files, {files * clusters} contexts, {total / 1e6:.1f} MB")
+        setup = 'source "$ZPE_SCRIPT"\nzpe_register_default_modules\nexport KUBECONFIG'
+        report("cold (files re-read)", time_block(setup, "ZPE_KUBE_CACHE_SIG=; zpe_module_kubectl", runs, env))
+        report("cached", time_block(setup, "zpe_module_kubectl", runs, env))
+        if shutil.which("kubectl"):
+            block = (
+                "kubectl config current-context >/dev/null; "
+                "kubectl config view --minify --output 'jsonpath={..namespace}' >/dev/null"
+            )
+            report("kubectl config (before)", time_block(setup, block, min(runs, 5), env))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,35 @@
+"""
+Render benchmark: generic zpe_render_prompt loop vs the config-compiled
+zpe_render_compiled. Modules that exec external tools are stubbed so the
+numbers reflect dispatch overhead only.
+
+    python bench/bench_render.py [runs]
+"""
+from __future__ import annotations
+
+import sys
+
+from common import report, require_zsh, time_block
+
+SETUP = """
+source "$ZPE_SCRIPT"
+zpe_register_default_modules
+function zpe__git_resolve() { return 1; }
+function zpe__kubectl_config() { return 1; }
+function zpe__loadavg() { REPLY=0.42; }
+function zpe__battery_percent_and_status() { REPLY="80|Full"; }
+VIRTUAL_ENV=/tmp/venv
+zpe_compile_render
+"""
+
+
+def main() -> int:
+    require_zsh()
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    report("generic loop", time_block(SETUP, "zpe__render_generic", runs))
+    report("compiled render", time_block(SETUP, "zpe_render_compiled", runs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
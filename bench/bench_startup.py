@@ -0,0 +1,40 @@
+"""
+Startup benchmark: cold config load (Python loader) vs warm start (sourcing
+the compiled artifact after a zstat staleness check).
+
+    python bench/bench_startup.py [runs]
+"""
+from __future__ import annotations
+
+import pathlib
+import sys
+import tempfile
+
+from common import count_spawns, report, require_zsh, time_block
+
+SETUP = 'source "$ZPE_SCRIPT"; zmodload -F zsh/files b:zf_rm'
+
+
+def main() -> int:
+    require_zsh()
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        config = pathlib.Path(tmp) / "zpe.toml"
+        config.write_text("[prompt]\nseparator = ' :: '\n", encoding="utf-8")
+        cache = pathlib.Path(tmp) / "cache"
+        env = {"ZPE_CONFIG_PATH": str(config), "ZPE_CACHE_DIR": str(cache)}
+
+        cold = 'zf_rm -rf -- "$ZPE_CACHE_DIR"; zpe_load_config'
+        report("cold start (python loader)", time_block(SETUP, cold, runs, env))
+        report("warm start (artifact)", time_block(SETUP, "zpe_load_config", runs, env))
+
+        spawns = count_spawns(SETUP + "\nzpe_load_config", "zpe_load_config", env)
+        if spawns < 0:
+            print("process count unavailable (no /proc/sys/kernel/ns_last_pid)")
+        else:
+            print(f"processes spawned by warm start: {spawns}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,77 @@
+"""
+Shared helpers for the zsh-prompt-engine benchmarks.
+
+Benchmarks drive a real zsh; timings are taken inside the shell with
+$EPOCHREALTIME so interpreter startup is not counted. Process spawns are
+counted from the kernel's last-allocated PID, which is noisy on a busy host,
+so callers take the minimum over several runs.
+"""
+from __future__ import annotations
+
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import textwrap
+from typing import Dict, List, Optional
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+ZPE_SCRIPT = ROOT / "src" / "zpe.zsh"
+LAST_PID = pathlib.Path("/proc/sys/kernel/ns_last_pid")
+
+
+def require_zsh() -> None:
+    if shutil.which("zsh") is None:
+        raise SystemExit("zsh is required to run this benchmark")
+
+
+def run_zsh(script: str, extra_env: Optional[Dict[str, str]] = None) -> str:
+    env = os.environ.copy()
+    env.update({"ZPE_ROOT": str(ROOT), "ZPE_SCRIPT": str(ZPE_SCRIPT)})
+    if extra_env:
+        env.update(extra_env)
+    result = subprocess.run(["zsh", "-c", script], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"zsh failed: {result.stderr}")
+    return result.stdout.strip()
+
+
+def time_block(setup: str, block: str, runs: int, extra_env: Optional[Dict[str, str]] = None) -> List[float]:
+    """Return per-iteration milliseconds for `block`, measured inside one zsh."""
+    script = textwrap.dedent(
+        f"""
+        zmodload zsh/datetime
+        {setup}
+        typeset -F t0
+        repeat {runs}; do
+          t0=$EPOCHREALTIME
+          {block}
+          print -r -- $(( (EPOCHREALTIME - t0) * 1000 ))
+        done
+        """
+    )
+    return [float(line) for line in run_zsh(script, extra_env).splitlines() if line]
+
+
+def count_spawns(setup: str, block: str, extra_env: Optional[Dict[str, str]] = None, attempts: int = 5) -> int:
+    """Count processes created while `block` runs (minimum over attempts)."""
+    if not LAST_PID.exists():
+        return -1
+    script = textwrap.dedent(
+        f"""
+        {setup}
+        typeset before=$(<{LAST_PID})
+        {block}
+        typeset after=$(<{LAST_PID})
+        print -r -- $(( after - before ))
+        """
+    )
+    return min(int(run_zsh(script, extra_env).splitlines()[-1]) for _ in range(attempts))
+
+
+def report(name: str, samples: List[float]) -> None:
+    samples = sorted(samples)
+    median = samples[len(samples) // 2]
+    print(f"{name:<32} median {median:8.3f} ms   min {samples[0]:8.3f} ms   n={len(samples)}")
+    sys.stdout.flush()
@@ -0,0 +1,41 @@
+"""Synthetic git repositories for the git benchmarks."""
+from __future__ import annotations
+
+import pathlib
+import subprocess
+from typing import Iterable, Optional
+
+GIT_ID = ["-c", "user.name=zpe-bench", "-c", "user.email=bench@zpe.invalid"]
+
+
+def git(repo: pathlib.Path, *args: str) -> None:
+    subprocess.run(["git", "-C", str(repo), *GIT_ID, *args], check=True, stdout=subprocess.DEVNULL)
+
+
+def make_repo(
+    root: pathlib.Path,
+    files: int,
+    per_dir: int = 500,
+    dirty: int = 20,
+    subdirs: Optional[Iterable[str]] = None,
+) -> pathlib.Path:
+    """
+    Create a repo with `files` tracked files spread over directories of
+    `per_dir` entries (optionally under each of `subdirs`), commit it, then
+    modify `dirty` files so status has something to report.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    git(root, "init", "-q")
+    prefixes = list(subdirs or [""])
+    paths = []
+    for i in range(files):
+        prefix = prefixes[i % len(prefixes)]
+        path = root / prefix / f"d{i // per_dir:04d}" / f"f{i:07d}.txt"
+        paths.append(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"{i}\n", encoding="utf-8")
+    git(root, "add", "-A")
+    git(root, "commit", "-q", "-m", "synthetic")
+    for path in paths[:: max(1, files // max(1, dirty))][:dirty]:
+        path.write_text("changed\n", encoding="utf-8")
+    return root
@@ -97,6 +97,15 @@ if $uninstall; then
   exit 0
 fi
 
+sync_defaults() {
+  if command -v python3 >/dev/null 2>&1; then
+    python3 "${SCRIPT_DIR}/scripts/config_loader.py" --sync-defaults "${SCRIPT_DIR}/src/zpe.zsh"
+  else
+    echo "python3 not found; keeping the shipped defaults block in src/zpe.zsh"
+  fi
+}
+
+sync_defaults
 ensure_bin_dir
 create_symlink
 
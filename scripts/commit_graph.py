@@ -0,0 +1,267 @@
+"""
+Ahead/behind counts between two commits from git's commit-graph file.
+
+Reads objects/info/commit-graph (or a split commit-graph chain) through mmap
+and walks both tips in generation order, painting each commit with the side
+it is reachable from. The walk stops as soon as everything left in the queue
+is reachable from both tips, or after --max-walk commits, in which case the
+counts are lower bounds and complete=0 is printed.
+
+Commits newer than the graph are read from loose objects. Exit status 2
+means the graph is missing or a commit could not be found in it or as a
+loose object; the caller should fall back to `git rev-list`.
+"""
+from __future__ import annotations
+
+import argparse
+import heapq
+import mmap
+import pathlib
+import struct
+import sys
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+GRAPH_SIGNATURE = b"CGPH"
+GRAPH_PARENT_NONE = 0x70000000
+GRAPH_EXTRA_EDGES = 0x80000000
+GRAPH_EDGE_LAST = 0x80000000
+HASH_LEN = {1: 20, 2: 32}
+LEFT, RIGHT = 1, 2
+BOTH = LEFT | RIGHT
+
+
+class CommitGraphError(RuntimeError):
+    pass
+
+
+class GraphLayer:
+    """One commit-graph file; positions are local to the file."""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        with open(path, "rb") as handle:
+            self.data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version, hash_version, chunks = struct.unpack_from(">4sBBBx", self.data, 0)
+        if signature != GRAPH_SIGNATURE or version != 1 or hash_version not in HASH_LEN:
+            raise CommitGraphError(f"{path}: not a commit-graph this reader understands")
+        self.hash_len = HASH_LEN[hash_version]
+        table: Dict[bytes, int] = {}
+        for i in range(chunks):
+            chunk_id, offset = struct.unpack_from(">4sQ", self.data, 8 + 12 * i)
+            table[chunk_id] = offset
+        try:
+            self.fanout = table[b"OIDF"]
+            self.oids = table[b"OIDL"]
+            self.commits = table[b"CDAT"]
+        except KeyError as err:
+            raise CommitGraphError(f"{path}: missing chunk {err.args[0].decode()}") from None
+        self.edges = table.get(b"EDGE")
+        (self.count,) = struct.unpack_from(">I", self.data, self.fanout + 255 * 4)
+
+    def find(self, oid: bytes) -> Optional[int]:
+        first = oid[0]
+        lo = struct.unpack_from(">I", self.data, self.fanout + (first - 1) * 4)[0] if first else 0
+        (hi,) = struct.unpack_from(">I", self.data, self.fanout + first * 4)
+        size = self.hash_len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.oids + mid * size
+            probe = self.data[start:start + size]
+            if probe == oid:
+                return mid
+            if probe < oid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def oid(self, pos: int) -> bytes:
+        start = self.oids + pos * self.hash_len
+        return self.data[start:start + self.hash_len]
+
+    def record(self, pos: int) -> Tuple[int, List[int]]:
+        """(generation, global parent positions) for a local position."""
+        offset = self.commits + pos * (self.hash_len + 16) + self.hash_len
+        parent1, parent2, gen_word, _ = struct.unpack_from(">IIII", self.data, offset)
+        parents: List[int] = []
+        if parent1 != GRAPH_PARENT_NONE:
+            parents.append(parent1)
+        if parent2 & GRAPH_EXTRA_EDGES:
+            # Octopus merge: the rest of the parents are listed in EDGE
+            if self.edges is None:
+                raise CommitGraphError("octopus merge without an EDGE chunk")
+            edge = self.edges + (parent2 & ~GRAPH_EXTRA_EDGES) * 4
+            while True:
+                (value,) = struct.unpack_from(">I", self.data, edge)
+                parents.append(value & ~GRAPH_EDGE_LAST)
+                if value & GRAPH_EDGE_LAST:
+                    break
+                edge += 4
+        elif parent2 != GRAPH_PARENT_NONE:
+            parents.append(parent2)
+        # Top 30 bits: topological level (generation number v1)
+        return gen_word >> 2, parents
+
+
+class CommitGraph:
+    """A single commit-graph file or a split chain, base layer first."""
+
+    def __init__(self, layers: List[GraphLayer]) -> None:
+        self.layers = layers
+        self.offsets: List[int] = []
+        total = 0
+        for layer in layers:
+            self.offsets.append(total)
+            total += layer.count
+
+    @classmethod
+    def open(cls, objects: pathlib.Path) -> "CommitGraph":
+        chain = objects / "info" / "commit-graphs" / "commit-graph-chain"
+        if chain.exists():
+            names = chain.read_text(encoding="ascii").split()
+            return cls([GraphLayer(chain.parent / f"graph-{name}.graph") for name in names])
+        single = objects / "info" / "commit-graph"
+        if single.exists():
+            return cls([GraphLayer(single)])
+        raise CommitGraphError("no commit-graph")
+
+    def find(self, oid: bytes) -> Optional[int]:
+        for layer, offset in zip(self.layers, self.offsets):
+            pos = layer.find(oid)
+            if pos is not None:
+                return offset + pos
+        return None
+
+    def _locate(self, pos: int) -> Tuple[GraphLayer, int]:
+        for layer, offset in zip(reversed(self.layers), reversed(self.offsets)):
+            if pos >= offset:
+                return layer, pos - offset
+        raise CommitGraphError(f"position {pos} out of range")
+
+    def oid(self, pos: int) -> bytes:
+        layer, local = self._locate(pos)
+        return layer.oid(local)
+
+    def record(self, pos: int) -> Tuple[int, List[bytes]]:
+        layer, local = self._locate(pos)
+        generation, parents = layer.record(local)
+        return generation, [self.oid(parent) for parent in parents]
+
+
+class CommitSource:
+    """Generation and parents per commit: the graph first, then loose objects."""
+
+    def __init__(self, objects: pathlib.Path, graph: CommitGraph) -> None:
+        self.objects = objects
+        self.graph = graph
+        self.known: Dict[bytes, Tuple[int, List[bytes]]] = {}
+
+    def loose_parents(self, oid: bytes) -> List[bytes]:
+        hexoid = oid.hex()
+        path = self.objects / hexoid[:2] / hexoid[2:]
+        try:
+            raw = zlib.decompress(path.read_bytes())
+        except (OSError, zlib.error):
+            raise CommitGraphError(f"commit {hexoid} is neither in the graph nor loose") from None
+        header, _, body = raw.partition(b"\0")
+        if not header.startswith(b"commit "):
+            raise CommitGraphError(f"{hexoid} is not a commit")
+        headers = body.split(b"\n\n", 1)[0].split(b"\n")
+        return [bytes.fromhex(line[7:].decode("ascii")) for line in headers if line.startswith(b"parent ")]
+
+    def info(self, oid: bytes) -> Tuple[int, List[bytes]]:
+        if oid in self.known:
+            return self.known[oid]
+        # Commits above the graph are loose; their generation is one more than
+        # their highest parent, resolved without recursion
+        stack = [oid]
+        loose: Dict[bytes, List[bytes]] = {}
+        while stack:
+            top = stack[-1]
+            if top in self.known:
+                stack.pop()
+                continue
+            pos = self.graph.find(top)
+            if pos is not None:
+                self.known[top] = self.graph.record(pos)
+                stack.pop()
+                continue
+            if top not in loose:
+                loose[top] = self.loose_parents(top)
+            missing = [parent for parent in loose[top] if parent not in self.known]
+            if missing:
+                stack.extend(missing)
+                continue
+            generation = 1 + max((self.known[parent][0] for parent in loose[top]), default=0)
+            self.known[top] = (generation, loose[top])
+            stack.pop()
+        return self.known[oid]
+
+
+def ahead_behind(source: CommitSource, left: bytes, right: bytes, max_walk: int) -> Tuple[int, int, bool]:
+    """
+    Commits reachable only from left (ahead) and only from right (behind).
+    Children always have a higher generation than their parents, so popping
+    in generation order sees every commit after all of its children.
+    """
+    flags: Dict[bytes, int] = {}
+    heap: List[Tuple[int, bytes]] = []
+    for oid, side in ((left, LEFT), (right, RIGHT)):
+        if oid not in flags:
+            heapq.heappush(heap, (-source.info(oid)[0], oid))
+        flags[oid] = flags.get(oid, 0) | side
+    pending = sum(1 for value in flags.values() if value != BOTH)
+
+    ahead = behind = walked = 0
+    while heap and pending:
+        _, oid = heapq.heappop(heap)
+        side = flags[oid]
+        if side != BOTH:
+            pending -= 1
+        walked += 1
+        if walked > max_walk:
+            return ahead, behind, False
+        if side == LEFT:
+            ahead += 1
+        elif side == RIGHT:
+            behind += 1
+        for parent in source.info(oid)[1]:
+            old = flags.get(parent)
+            if old is None:
+                flags[parent] = side
+                heapq.heappush(heap, (-source.info(parent)[0], parent))
+                if side != BOTH:
+                    pending += 1
+            elif old | side != old:
+                flags[parent] = old | side
+                if old | side == BOTH:
+                    pending -= 1
+    return ahead, behind, True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--gitdir", required=True, help="git common dir (holds objects/)")
+    parser.add_argument("--max-walk", type=int, default=10000, help="stop after this many commits")
+    parser.add_argument("left", help="local commit (ahead side)")
+    parser.add_argument("right", help="upstream commit (behind side)")
+    args = parser.parse_args()
+
+    objects = pathlib.Path(args.gitdir) / "objects"
+    try:
+        source = CommitSource(objects, CommitGraph.open(objects))
+        ahead, behind, complete = ahead_behind(
+            source, bytes.fromhex(args.left), bytes.fromhex(args.right), args.max_walk
+        )
+    except (CommitGraphError, OSError, ValueError, struct.error) as err:
+        print(f"zpe: commit-graph: {err}", file=sys.stderr)
+        return 2
+
+    print(f"ahead={ahead}")
+    print(f"behind={behind}")
+    print(f"complete={int(complete)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
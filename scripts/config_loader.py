@@ -2,7 +2,8 @@
 Parse a user config (TOML or YAML) and emit Zsh-friendly assignments.
 The output is meant to be eval'd by the shell.
 Includes a small cache keyed by config mtime and defaults fingerprint to
-avoid re-parsing on repeated runs.
+avoid re-parsing on repeated runs, and writes the payload as a standalone
+.zsh artifact plus stamp so the shell can source it without starting Python.
 """
 from __future__ import annotations
 
@@ -32,6 +33,15 @@ DEFAULTS: Dict[str, Any] = {
         "separator": " | ",
         "enable_animation": True,
         "frame_interval": 1,
+        "async_placeholder": "…",
+        "prefetch": ["git"],
+        "prefetch_threshold_ms": 1000,
+        "dir_cache_size": 64,
+        "stale_marker": "?",
+        "timeout_backoff_max": 300,
+        "shared": [],
+        "store_size": 256,
+        "store_wait": 2,
     },
     "modules": {
         "order": ["art", "project", "git", "system", "kubectl", "venv", "battery"],
@@ -42,11 +52,33 @@ DEFAULTS: Dict[str, Any] = {
         "show_branch": True,
         "show_status": True,
         "max_branch_len": 0,
+        "mode": "sync",
+        "timeout_ms": 0,
+        "cache_max_age": 5,
+        "engine": "status",
+        "read_only": False,
+        "scope": "repo",
+        "show_ahead_behind": True,
+        "ahead_behind_max_walk": 10000,
+        "show_stash": True,
+        "watcher": False,
+        "watcher_max_watches": 8192,
+        "watcher_idle": 600,
+        "project_markers": ["pyproject.toml", "package.json", "go.mod", "Cargo.toml"],
+        "large_repo_threshold": 100000,
+        "large_repo_strategy": "capped",
+        "large_repo_max_entries": 1000,
+        "large_repo_untracked": False,
+        "large_repo_fsmonitor": False,
     },
     "system": {
         "enabled": True,
         "show_time": True,
+        "time_format": "%H:%M",
         "show_load": True,
+        "show_cpu": False,
+        "show_mem": False,
+        "show_disk": False,
     },
     "colors": {
         "primary": "cyan",
@@ -55,11 +87,13 @@ DEFAULTS: Dict[str, Any] = {
     },
     "art": {
         "enabled": True,
-        "frames": ["(>", "=>", ">="]
+        "frames": ["<o", "o>", "^o", "o^"],
     },
     "kubectl": {
         "enabled": True,
         "show_namespace": True,
+        "mode": "sync",
+        "timeout_ms": 0,
     },
     "venv": {
         "enabled": True,
@@ -74,11 +108,43 @@ DEFAULTS: Dict[str, Any] = {
         "show_status": True,
         "warn_threshold": 20,
         "critical_threshold": 10,
+        "show_time_left": True,
+        "refresh": 30,
+        "discovery_ttl": 600,
+    },
+    "collector": {
+        "enabled": False,
+        "interval": 2,
+        "idle": 60,
+    },
+    "daemon": {
+        "enabled": False,
+        "modules": ["git", "kubectl"],
+        "env": ["KUBECONFIG"],
+        "timeout_ms": 300,
+        "idle": 600,
+        "workers": 8,
+        "cache_size": 512,
+        "providers": [],
+    },
+    "invalidate": {
+        "safe": [
+            "ls", "ls *", "ll", "ll *", "la", "la *", "cat *", "less *", "more *", "head *", "tail *",
+            "grep *", "rg *", "man *", "pwd", "clear", "echo *", "which *", "type *", "whence *", "history*",
+            "cd", "cd *", "pushd*", "popd*", "kubectl get *", "kubectl describe *", "kubectl logs *",
+            "git log*", "git show*", "git diff*", "git status*",
+        ],
+        "unknown": ["git"],
+        "git": ["git *", "tig*", "lazygit*", "gh *"],
     },
 }
 
 CACHE_SCHEMA = 1
 
+# Markers around the defaults block in src/zpe.zsh that sync_defaults_block() owns
+DEFAULTS_BEGIN = "# >>> generated from scripts/config_loader.py DEFAULTS; run `make defaults` >>>"
+DEFAULTS_END = "# <<< generated defaults <<<"
+
 
 class ConfigError(RuntimeError):
     pass
@@ -124,7 +190,16 @@ def merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def sh_escape(value: str) -> str:
-    return value.replace("\\", "\\\\").replace("\"", "\\\"")
+    for char in ("\\", "\"", "$", "`"):
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def sh_value(value: Any) -> str:
+    # Modules compare against lowercase true/false
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
 
 
 def emit_array(name: str, values: Iterable[str]) -> str:
@@ -135,7 +210,7 @@ def emit_array(name: str, values: Iterable[str]) -> str:
 def emit_assoc(name: str, mapping: Dict[str, Any]) -> str:
     lines = [f"typeset -gA {name}\n"]
     for key, value in mapping.items():
-        lines.append(f'{name}["{sh_escape(str(key))}"]="{sh_escape(str(value))}"\n')
+        lines.append(f'{name}["{sh_escape(str(key))}"]="{sh_escape(sh_value(value))}"\n')
     return "".join(lines)
 
 
@@ -150,11 +225,23 @@ def build_shell_payload(config: Dict[str, Any]) -> str:
     venv_cfg = config.get("venv", {})
     project_cfg = config.get("project", {})
     battery_cfg = config.get("battery", {})
+    invalidate_cfg = config.get("invalidate", {})
+    collector_cfg = config.get("collector", {})
+    daemon_cfg = config.get("daemon", {})
 
     payload: List[str] = []
     payload.append(f'ZPE_SEPARATOR="{sh_escape(str(prompt_cfg.get("separator", " | ")))}"\n')
-    payload.append(f'ZPE_ENABLE_ANIMATION={str(prompt_cfg.get("enable_animation", True)).lower()}\n')
+    payload.append(f'ZPE_ENABLE_ANIMATION={sh_value(prompt_cfg.get("enable_animation", True)).lower()}\n')
     payload.append(f'ZPE_FRAME_INTERVAL={int(prompt_cfg.get("frame_interval", 1))}\n')
+    payload.append(f'ZPE_ASYNC_PLACEHOLDER="{sh_escape(str(prompt_cfg.get("async_placeholder", "…")))}"\n')
+    payload.append(emit_array("ZPE_PREFETCH_MODULES", prompt_cfg.get("prefetch", [])))
+    payload.append(f'ZPE_PREFETCH_THRESHOLD_MS={int(prompt_cfg.get("prefetch_threshold_ms", 1000))}\n')
+    payload.append(f'ZPE_DIR_CACHE_SIZE={int(prompt_cfg.get("dir_cache_size", 64))}\n')
+    payload.append(f'ZPE_STALE_MARKER="{sh_escape(str(prompt_cfg.get("stale_marker", "?")))}"\n')
+    payload.append(f'ZPE_TIMEOUT_BACKOFF_MAX={int(prompt_cfg.get("timeout_backoff_max", 300))}\n')
+    payload.append(emit_array("ZPE_SHARED_MODULES", prompt_cfg.get("shared", [])))
+    payload.append(f'ZPE_STORE_SIZE={int(prompt_cfg.get("store_size", 256))}\n')
+    payload.append(f'ZPE_STORE_WAIT={int(prompt_cfg.get("store_wait", 2))}\n')
 
     payload.append(emit_array("ZPE_MODULE_ORDER", modules_cfg.get("order", [])))
     payload.append(emit_array("ZPE_MODULES_DISABLED", modules_cfg.get("disabled", [])))
@@ -163,17 +250,45 @@ def build_shell_payload(config: Dict[str, Any]) -> str:
     # Emit art config without frames (frames are in array above)
     art_conf_without_frames = {k: v for k, v in art_cfg.items() if k != "frames"}
     payload.append(emit_assoc("ZPE_ART_CONF", art_conf_without_frames))
-    payload.append(emit_assoc("ZPE_GIT_CONF", git_cfg))
+    payload.append(emit_array("ZPE_GIT_PROJECT_MARKERS", git_cfg.get("project_markers", [])))
+    payload.append(emit_assoc("ZPE_GIT_CONF", {k: v for k, v in git_cfg.items() if k != "project_markers"}))
     payload.append(emit_assoc("ZPE_SYSTEM_CONF", system_cfg))
     payload.append(emit_assoc("ZPE_COLOR_CONF", color_cfg))
     payload.append(emit_assoc("ZPE_KUBE_CONF", kube_cfg))
     payload.append(emit_assoc("ZPE_VENV_CONF", venv_cfg))
     payload.append(emit_assoc("ZPE_PROJECT_CONF", project_cfg))
+    payload.append(emit_assoc("ZPE_COLLECTOR_CONF", collector_cfg))
+    payload.append(emit_array("ZPE_DAEMON_MODULES", daemon_cfg.get("modules", [])))
+    payload.append(emit_array("ZPE_DAEMON_ENV", daemon_cfg.get("env", [])))
+    # providers, workers and cache_size are read by the daemon itself
+    payload.append(emit_assoc("ZPE_DAEMON_CONF", {k: v for k, v in daemon_cfg.items()
+                                                  if k in ("enabled", "timeout_ms", "idle")}))
     payload.append(emit_assoc("ZPE_BATTERY_CONF", battery_cfg))
+    # One pattern per line; modules split them with ${(f)...}
+    payload.append(emit_assoc("ZPE_INVALIDATE", {k: "\n".join(v) for k, v in invalidate_cfg.items()}))
 
     return "".join(payload)
 
 
+def render_defaults_block() -> str:
+    return f"{DEFAULTS_BEGIN}\n{build_shell_payload(DEFAULTS)}{DEFAULTS_END}\n"
+
+
+def sync_defaults_block(zsh_path: pathlib.Path) -> bool:
+    """Rewrite the generated defaults block in zsh_path; return True if it changed."""
+    text = zsh_path.read_text(encoding="utf-8")
+    start = text.find(DEFAULTS_BEGIN)
+    end = text.find(DEFAULTS_END)
+    if start < 0 or end < start:
+        raise ConfigError(f"defaults markers not found in {zsh_path}")
+    end = text.index("\n", end) + 1
+    updated = text[:start] + render_defaults_block() + text[end:]
+    if updated == text:
+        return False
+    atomic_write(zsh_path, updated)
+    return True
+
+
 def cache_dir_from_env() -> pathlib.Path:
     env_value = os.environ.get("ZPE_CACHE_DIR")
     if env_value:
@@ -216,6 +331,49 @@ def write_cache(cache_file: pathlib.Path, mtime_ns: int, fingerprint: str, paylo
     cache_file.write_text(json.dumps(blob), encoding="utf-8")
 
 
+def artifact_paths(config_path: pathlib.Path, cache_dir: pathlib.Path) -> Tuple[pathlib.Path, pathlib.Path]:
+    """
+    Return (artifact, stamp) paths for a config.
+    Names are derived from the path itself (not a hash) so zsh can locate
+    them without forking: "/home/me/zpe.toml" -> "home%me%zpe.toml.zsh".
+    """
+    stem = str(config_path).lstrip("/").replace("/", "%")
+    return cache_dir / f"{stem}.zsh", cache_dir / f"{stem}.stamp"
+
+
+def build_stamp(config_path: pathlib.Path, st: os.stat_result, fingerprint: str) -> str:
+    loader_mtime_ns = pathlib.Path(__file__).resolve().stat().st_mtime_ns
+    fields = [
+        ("schema", CACHE_SCHEMA),
+        ("config", config_path),
+        ("mtime_ns", st.st_mtime_ns),
+        ("size", st.st_size),
+        ("defaults_hash", fingerprint),
+        ("loader_mtime_ns", loader_mtime_ns),
+    ]
+    return "".join(f"{key}={value}\n" for key, value in fields)
+
+
+def atomic_write(path: pathlib.Path, text: str) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def write_artifact(
+    config_path: pathlib.Path,
+    cache_dir: pathlib.Path,
+    st: os.stat_result,
+    fingerprint: str,
+    payload: str,
+) -> None:
+    """Write the sourceable payload first, then the stamp that validates it."""
+    artifact, stamp = artifact_paths(config_path, cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    atomic_write(artifact, payload)
+    atomic_write(stamp, build_stamp(config_path, st, fingerprint))
+
+
 def load_config_cached(
     path: pathlib.Path,
     cache_dir: Optional[pathlib.Path] = None,
@@ -225,13 +383,16 @@ def load_config_cached(
     If cache_dir is None, caching is skipped.
     """
 
-    mtime_ns = path.stat().st_mtime_ns
+    st = path.stat()
+    mtime_ns = st.st_mtime_ns
     fingerprint = defaults_fingerprint()
 
     if cache_dir is not None:
         cache_file = cache_file_for(path, cache_dir)
         cached_payload = read_cache(cache_file, mtime_ns, fingerprint)
         if cached_payload is not None:
+            # The shell only calls us when its stamp looked stale; refresh it.
+            write_artifact(path, cache_dir, st, fingerprint, cached_payload)
             return cached_payload, True
 
     config = load_config(path)
@@ -239,22 +400,34 @@ def load_config_cached(
 
     if cache_dir is not None:
         write_cache(cache_file, mtime_ns, fingerprint, payload)
+        write_artifact(path, cache_dir, st, fingerprint, payload)
 
     return payload, False
 
 
 def main() -> int:
     if len(sys.argv) < 2:
-        raise SystemExit("Usage: config_loader.py <path-to-config>")
+        raise SystemExit("Usage: config_loader.py <path-to-config> | --sync-defaults <zpe.zsh>")
+    if sys.argv[1] == "--sync-defaults":
+        if len(sys.argv) < 3:
+            raise SystemExit("Usage: config_loader.py --sync-defaults <zpe.zsh>")
+        try:
+            changed = sync_defaults_block(pathlib.Path(sys.argv[2]))
+        except ConfigError as err:
+            print(f"zpe: {err}", file=sys.stderr)
+            return 1
+        print(f"{sys.argv[2]}: defaults {'updated' if changed else 'up to date'}")
+        return 0
     path = pathlib.Path(sys.argv[1]).expanduser().resolve()
     cache_dir = cache_dir_from_env()
+    # stderr goes straight to the terminal, so prefix like zpe_log does
     try:
         payload, _ = load_config_cached(path, cache_dir)
     except ConfigError as err:
-        print(err, file=sys.stderr)
+        print(f"zpe: {err}", file=sys.stderr)
         return 1
     except Exception as err:  # pragma: no cover - defensive
-        print(f"unexpected error: {err}", file=sys.stderr)
+        print(f"zpe: unexpected error: {err}", file=sys.stderr)
         return 1
 
     sys.stdout.write(payload)
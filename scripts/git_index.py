@@ -0,0 +1,390 @@
+"""
+Count added/modified/deleted paths for the git segment without `git status`.
+
+Reads .git/index directly (versions 2, 3 and 4) through mmap + struct and
+compares each entry's cached stat data against the work tree using a thread
+pool of lstat calls. Entries whose stat data changed but whose size did not,
+and racily clean entries, cannot be decided from stat alone; those few paths
+are handed to `git diff` in one call, along with submodules. As in git, the
+executable bit is ignored with core.fileMode false, and a symlink checked out
+as a plain file with core.symlinks false. Staged changes come from
+`git diff-index --cached`, which never touches the work tree.
+
+Output is key=value lines for the shell. Exit status 2 means the index could
+not be read this way (split/sparse index, unknown version) and the caller
+should fall back to `git status`.
+"""
+from __future__ import annotations
+
+import argparse
+import functools
+import mmap
+import os
+import pathlib
+import re
+import stat
+import struct
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+FLAG_ASSUME_VALID = 0x8000
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE_MASK = 0x3000
+FLAG_NAME_MASK = 0x0FFF
+XFLAG_INTENT_TO_ADD = 0x2000
+XFLAG_SKIP_WORKTREE = 0x4000
+UNSUPPORTED_EXTENSIONS = {b"link", b"sdir"}
+FALLBACK_CHUNK = 1000
+SCAN_CHUNK = 2048
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+class GitIndexError(RuntimeError):
+    pass
+
+
+class IndexEntry(NamedTuple):
+    path: str
+    ctime: Tuple[int, int]
+    mtime: Tuple[int, int]
+    dev: int
+    ino: int
+    mode: int
+    size: int
+    stage: int
+    assume_valid: bool
+    skip_worktree: bool
+    intent_to_add: bool
+
+
+def find_gitdir(root: pathlib.Path) -> pathlib.Path:
+    dotgit = root / ".git"
+    if dotgit.is_file():
+        target = dotgit.read_text(encoding="utf-8").strip()
+        if target.startswith("gitdir:"):
+            target = target[len("gitdir:"):].strip()
+        return (root / target).resolve()
+    return dotgit
+
+
+def read_config(gitdir: pathlib.Path) -> str:
+    """Text of the repository config, shared by linked worktrees; "" when unreadable."""
+    config = gitdir / "config"
+    commondir = gitdir / "commondir"
+    if commondir.exists():
+        config = (gitdir / commondir.read_text(encoding="utf-8").strip() / "config").resolve()
+    try:
+        return config.read_text(encoding="utf-8")
+    except OSError:
+        return ""
+
+
+def config_bool(text: str, section: str, key: str, default: bool) -> bool:
+    """Last value of section.key in config text, read as git reads a boolean."""
+    value: Optional[bool] = None
+    current = ""
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].split(";", 1)[0].strip()
+        if line.startswith("["):
+            current = line[1:line.find("]")].strip().lower()
+        elif current == section and line:
+            name, has_value, raw = line.partition("=")
+            if name.strip().lower() == key:
+                # A bare key means true
+                value = not has_value or raw.strip().lower() not in ("false", "no", "off", "0", "")
+    return default if value is None else value
+
+
+def hash_size(gitdir: pathlib.Path) -> int:
+    text = read_config(gitdir)
+    return 32 if re.search(r"^\s*objectformat\s*=\s*sha256\s*$", text, re.I | re.M) else 20
+
+
+def read_varint(buf: Buffer, pos: int) -> Tuple[int, int]:
+    """Git's offset varint used by index v4 path compression."""
+    byte = buf[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        value += 1
+        byte = buf[pos]
+        pos += 1
+        value = (value << 7) + (byte & 0x7F)
+    return value, pos
+
+
+def parse_index(data: Buffer, oid_size: int = 20) -> List[IndexEntry]:
+    if len(data) < 12 or bytes(data[:4]) != b"DIRC":
+        raise GitIndexError("not a git index")
+    version, count = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3, 4):
+        raise GitIndexError(f"unsupported index version {version}")
+
+    entries: List[IndexEntry] = []
+    pos = 12
+    previous = b""
+    # ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size, (oid), flags
+    header = struct.Struct(f">10I{oid_size}xH")
+    for _ in range(count):
+        start = pos
+        fields = header.unpack_from(data, pos)
+        flags = fields[10]
+        pos += header.size
+        xflags = 0
+        if flags & FLAG_EXTENDED:
+            (xflags,) = struct.unpack_from(">H", data, pos)
+            pos += 2
+        if version == 4:
+            strip, pos = read_varint(data, pos)
+            end = data.find(b"\0", pos)
+            name = previous[: len(previous) - strip] + bytes(data[pos:end])
+            pos = end + 1
+        else:
+            name_len = flags & FLAG_NAME_MASK
+            if name_len == FLAG_NAME_MASK:
+                name_len = data.find(b"\0", pos) - pos
+            name = bytes(data[pos:pos + name_len])
+            # Entries are NUL padded to a multiple of 8 bytes
+            pos = start + ((pos - start + name_len + 8) & ~7)
+        previous = name
+        entries.append(
+            IndexEntry(
+                name.decode("utf-8", "surrogateescape"),
+                (fields[0], fields[1]),
+                (fields[2], fields[3]),
+                fields[4],
+                fields[5],
+                fields[6],
+                fields[9],
+                (flags & FLAG_STAGE_MASK) >> 12,
+                bool(flags & FLAG_ASSUME_VALID),
+                bool(xflags & XFLAG_SKIP_WORKTREE),
+                bool(xflags & XFLAG_INTENT_TO_ADD),
+            )
+        )
+
+    # Extensions follow the entries, up to the trailing checksum
+    while pos + 8 <= len(data) - oid_size:
+        signature = bytes(data[pos:pos + 4])
+        (size,) = struct.unpack_from(">I", data, pos + 4)
+        if signature in UNSUPPORTED_EXTENSIONS:
+            raise GitIndexError(f"index extension {signature.decode()} is not supported")
+        pos += 8 + size
+    return entries
+
+
+def load_index(gitdir: pathlib.Path) -> Tuple[List[IndexEntry], int]:
+    """Return (entries, index mtime_ns)."""
+    index = gitdir / "index"
+    with open(index, "rb") as handle:
+        st = os.fstat(handle.fileno())
+        if st.st_size == 0:
+            return [], st.st_mtime_ns
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_index(data, hash_size(gitdir)), st.st_mtime_ns
+
+
+def worktree_mode(st: os.stat_result) -> int:
+    if stat.S_ISLNK(st.st_mode):
+        return 0o120000
+    return 0o100755 if st.st_mode & 0o100 else 0o100644
+
+
+def classify(
+    entry: IndexEntry,
+    st: Optional[os.stat_result],
+    index_mtime_ns: int,
+    filemode: bool = True,
+    symlinks: bool = True,
+) -> Optional[str]:
+    """
+    Work tree state of one entry: "D" deleted, "M" modified, "" clean, or
+    None when stat data alone cannot tell (content may still match).
+
+    filemode and symlinks are core.fileMode and core.symlinks: when false,
+    git ignores the executable bit, and a symlink checked out as a plain file.
+    """
+    if entry.assume_valid or entry.skip_worktree:
+        return ""
+    if entry.mode == 0o160000:
+        # Submodule: whether its commit or content changed is for git to say
+        return None
+    if st is None:
+        return "D"
+    if stat.S_ISDIR(st.st_mode):
+        return "D"
+    mode = worktree_mode(st)
+    if entry.mode == 0o120000 and not symlinks and stat.S_ISREG(st.st_mode):
+        pass
+    elif not filemode and stat.S_ISREG(st.st_mode) and entry.mode != 0o120000:
+        pass
+    elif mode != entry.mode:
+        return "M"
+    if st.st_size & 0xFFFFFFFF != entry.size:
+        return "M"
+    same_stat = (
+        (st.st_mtime_ns // 10**9) & 0xFFFFFFFF == entry.mtime[0]
+        and st.st_mtime_ns % 10**9 == entry.mtime[1]
+        and (st.st_ctime_ns // 10**9) & 0xFFFFFFFF == entry.ctime[0]
+        and st.st_ctime_ns % 10**9 == entry.ctime[1]
+        and st.st_ino & 0xFFFFFFFF == entry.ino
+    )
+    if not same_stat:
+        return None
+    # Racily clean: written in the same instant the index was, so a later
+    # same-size edit would be invisible to stat
+    if entry.mtime[0] * 10**9 + entry.mtime[1] >= index_mtime_ns:
+        return None
+    return ""
+
+
+def scan_chunk(
+    prefix: str, entries: List[IndexEntry], index_mtime_ns: int, filemode: bool = True, symlinks: bool = True,
+) -> List[Optional[str]]:
+    """lstat + classify one slice of the index; runs on a worker thread."""
+    states: List[Optional[str]] = []
+    for entry in entries:
+        try:
+            st: Optional[os.stat_result] = os.lstat(prefix + entry.path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        states.append(classify(entry, st, index_mtime_ns, filemode, symlinks))
+    return states
+
+
+def run_git(root: pathlib.Path, args: Iterable[str]) -> str:
+    result = subprocess.run(
+        ["git", "--no-optional-locks", "-C", str(root), *args],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise GitIndexError(result.stderr.strip() or f"git {' '.join(args)} failed")
+    return result.stdout
+
+
+def parse_name_status(out: str) -> Dict[str, str]:
+    """Map path -> status letter from `--name-status -z` output."""
+    fields = out.split("\0")
+    return {fields[i + 1]: fields[i][:1] for i in range(0, len(fields) - 1, 2)}
+
+
+def staged_changes(root: pathlib.Path, entries: List[IndexEntry], scope: str = "") -> Dict[str, str]:
+    pathspec = [f":(top,literal){scope}"] if scope else []
+    try:
+        return parse_name_status(
+            run_git(root, ["diff-index", "--cached", "--name-status", "--no-renames", "-z", "HEAD", "--", *pathspec])
+        )
+    except GitIndexError:
+        try:
+            run_git(root, ["rev-parse", "--verify", "--quiet", "HEAD"])
+        except GitIndexError:
+            # Unborn branch: everything in the index is new
+            return {entry.path: "A" for entry in entries if entry.stage == 0}
+        raise
+
+
+def resolve_undecided(root: pathlib.Path, paths: List[str]) -> Dict[str, str]:
+    """Let git compare content for the paths stat could not decide."""
+    changes: Dict[str, str] = {}
+    for i in range(0, len(paths), FALLBACK_CHUNK):
+        # Index paths are literal; "*", "?", "[" or a leading ":" are no pattern
+        chunk = [f":(top,literal){path}" for path in paths[i:i + FALLBACK_CHUNK]]
+        changes.update(parse_name_status(run_git(root, ["diff", "--name-status", "--no-renames", "-z", "--", *chunk])))
+    return changes
+
+
+def count_changes(
+    root: pathlib.Path,
+    workers: Optional[int] = None,
+    fallback: bool = True,
+    scope: str = "",
+) -> Dict[str, object]:
+    gitdir = find_gitdir(root)
+    entries, index_mtime_ns = load_index(gitdir)
+    config = read_config(gitdir)
+    filemode = config_bool(config, "core", "filemode", True)
+    symlinks = config_bool(config, "core", "symlinks", True)
+    if scope:
+        # Limit to one subdirectory, like a ":(top)scope" pathspec
+        below = scope.strip("/") + "/"
+        entries = [entry for entry in entries if entry.path.startswith(below)]
+    conflicted: Set[str] = {entry.path for entry in entries if entry.stage}
+    tracked = [entry for entry in entries if not entry.stage]
+
+    # One job per slice rather than per file: futures cost more than lstat
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    prefix = os.path.join(str(root), "")
+    chunks = [tracked[i:i + SCAN_CHUNK] for i in range(0, len(tracked), SCAN_CHUNK)]
+    scan = functools.partial(scan_chunk, prefix, index_mtime_ns=index_mtime_ns, filemode=filemode, symlinks=symlinks)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        states = [state for chunk in pool.map(scan, chunks) for state in chunk]
+
+    worktree: Dict[str, str] = {}
+    undecided: List[str] = []
+    for entry, state in zip(tracked, states):
+        if state is None:
+            undecided.append(entry.path)
+        elif state:
+            worktree[entry.path] = state
+        if entry.intent_to_add:
+            worktree[entry.path] = "A"
+
+    if undecided and fallback:
+        resolved = resolve_undecided(root, undecided)
+        worktree.update({path: status for path, status in resolved.items() if path not in conflicted})
+
+    staged = {path: status for path, status in staged_changes(root, tracked, scope).items() if path not in conflicted}
+
+    added = modified = deleted = 0
+    for path in set(staged) | set(worktree):
+        xy = staged.get(path, ".") + worktree.get(path, ".")
+        if "M" in xy:
+            modified += 1
+        elif "A" in xy:
+            added += 1
+        elif "D" in xy:
+            deleted += 1
+
+    return {
+        "added": added,
+        "modified": modified,
+        "deleted": deleted,
+        "staged": len(staged),
+        "unstaged": len(worktree),
+        "conflicted": len(conflicted),
+        "entries": len(entries),
+        "undecided": len(undecided),
+        "undecided_paths": undecided,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--root", default=".", help="work tree root (default: .)")
+    parser.add_argument("--scope", default="", help="only count below this directory, relative to the root")
+    parser.add_argument("--workers", type=int, default=None, help="lstat threads")
+    parser.add_argument("--no-fallback", action="store_true", help="do not ask git about undecided entries")
+    parser.add_argument("--list-undecided", action="store_true", help="print undecided paths to stderr")
+    args = parser.parse_args()
+
+    try:
+        result = count_changes(pathlib.Path(args.root), args.workers, not args.no_fallback, args.scope)
+    except (GitIndexError, OSError, struct.error, ValueError) as err:
+        print(f"zpe: git index: {err}", file=sys.stderr)
+        return 2
+
+    if args.list_undecided:
+        for path in result["undecided_paths"]:  # type: ignore[union-attr]
+            print(f"undecided: {path}", file=sys.stderr)
+    for key in ("added", "modified", "deleted", "staged", "unstaged", "conflicted", "entries", "undecided"):
+        print(f"{key}={result[key]}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,333 @@
+"""
+Per-user inotify watcher that tells prompts when a work tree changed.
+
+Shells ask for a repository by writing its work tree root to want/<name> in
+the state directory (name is repo_name() of the root: "%" and "/" escaped,
+so distinct roots never share a name), and rewrite it on each prompt shown
+there, so its mtime is the repo's last use. The root is always read from
+the file, never rebuilt from the name. The watcher
+adds inotify watches for every directory of the work tree, except .git, and
+keeps gen/<name> holding a generation string. The string changes whenever
+something in the tree changes. A shell that sees the same generation as at
+its last status knows the tree is unchanged.
+
+Watches are limited to --max-watches in total. Repos idle for longer than
+--idle seconds, or least recently used when room is needed, are dropped along
+with their gen file; repos too large for the budget are never watched. The
+watcher exits once no pid in shells/ is alive, removing all gen files so no
+shell trusts a stale generation. Linux only; inotify is reached via ctypes.
+"""
+from __future__ import annotations
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+TREE_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+WANT_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+TICK = 2.0
+
+
+class WatcherError(RuntimeError):
+    pass
+
+
+class Inotify:
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatcherError(f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+
+    def add(self, path: str, mask: int) -> int:
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatcherError("inotify watch limit reached (fs.inotify.max_user_watches)")
+            return -1
+        return wd
+
+    def remove(self, wd: int) -> None:
+        self._rm(self.fd, wd)
+
+    def read(self) -> List[tuple]:
+        """[(wd, mask, name)] for all queued events."""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, _, size = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + size].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            pos += size
+            events.append((wd, mask, name))
+        return events
+
+
+def repo_name(root: str) -> str:
+    """File name for a work tree root; modules/git.zsh escapes it the same way."""
+    return root.replace("%", "%25").replace("/", "%2F")
+
+
+class Repo:
+    def __init__(self, name: str, root: str) -> None:
+        self.name = name
+        self.root = root
+        self.wds: Dict[int, str] = {}
+        self.changed = False
+
+
+class Watcher:
+    def __init__(self, state: pathlib.Path, max_watches: int, idle: float) -> None:
+        self.state = state
+        self.want_dir = state / "want"
+        self.gen_dir = state / "gen"
+        self.shell_dir = state / "shells"
+        for directory in (self.want_dir, self.gen_dir, self.shell_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.max_watches = max_watches
+        self.idle = idle
+        self.inotify = Inotify()
+        self.repos: Dict[str, Repo] = {}
+        self.by_wd: Dict[int, Repo] = {}
+        self.too_large: Set[str] = set()
+        self.instance = f"{os.getpid()}.{time.time_ns()}"
+        self.sequence = 0
+        self.want_wd = self.inotify.add(str(self.want_dir), WANT_MASK)
+
+    # -- bookkeeping -------------------------------------------------------
+
+    @property
+    def watches(self) -> int:
+        return len(self.by_wd)
+
+    def wanted_root(self, name: str) -> Optional[str]:
+        """The root a shell asked for under name; None while the file is being written."""
+        try:
+            root = (self.want_dir / name).read_text(encoding="utf-8", errors="surrogateescape")
+        except OSError:
+            return None
+        return root if root and repo_name(root) == name else None
+
+    def last_used(self, name: str) -> float:
+        try:
+            return (self.want_dir / name).stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def publish(self, repo: Repo) -> None:
+        self.sequence += 1
+        tmp = self.gen_dir / f".{repo.name}.tmp"
+        tmp.write_text(f"{self.instance}:{self.sequence}\n", encoding="utf-8")
+        os.replace(tmp, self.gen_dir / repo.name)
+        repo.changed = False
+
+    def tree_dirs(self, root: str, limit: int) -> Optional[List[str]]:
+        """Directories to watch under root, or None when there are more than limit."""
+        dirs = [root]
+        pending = [root]
+        skip = {os.path.join(root, ".git"), str(self.state)}
+        while pending:
+            current = pending.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and entry.path not in skip:
+                    dirs.append(entry.path)
+                    pending.append(entry.path)
+                    if len(dirs) > limit:
+                        return None
+        return dirs
+
+    def watch_dir(self, repo: Repo, path: str) -> None:
+        wd = self.inotify.add(path, TREE_MASK)
+        if wd >= 0:
+            repo.wds[wd] = path
+            self.by_wd[wd] = repo
+
+    def add_repo(self, name: str) -> None:
+        if name in self.repos or name in self.too_large:
+            return
+        root = self.wanted_root(name)
+        if root is None:
+            return
+        if not os.path.isdir(os.path.join(root, ".git")) and not os.path.isfile(os.path.join(root, ".git")):
+            return
+        dirs = self.tree_dirs(root, self.max_watches)
+        if dirs is None:
+            self.too_large.add(name)
+            return
+        # Make room by dropping the least recently used repos
+        for victim in sorted(self.repos, key=self.last_used):
+            if self.watches + len(dirs) <= self.max_watches:
+                break
+            self.drop_repo(victim)
+        repo = Repo(name, root)
+        self.repos[name] = repo
+        for path in dirs:
+            self.watch_dir(repo, path)
+        self.publish(repo)
+
+    def drop_repo(self, name: str) -> None:
+        repo = self.repos.pop(name, None)
+        if repo is None:
+            return
+        for wd in repo.wds:
+            self.by_wd.pop(wd, None)
+            self.inotify.remove(wd)
+        for path in (self.gen_dir / name, self.want_dir / name):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # -- events ------------------------------------------------------------
+
+    def scan_wants(self) -> None:
+        names = {path.name for path in self.want_dir.iterdir() if not path.name.startswith(".")}
+        for name in names:
+            self.add_repo(name)
+        for name in list(self.repos):
+            if name not in names:
+                self.drop_repo(name)
+
+    def handle(self, events: List[tuple]) -> None:
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: every repo may have changed
+                for repo in self.repos.values():
+                    repo.changed = True
+                continue
+            if wd == self.want_wd:
+                if mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE) and not name.startswith("."):
+                    self.add_repo(name)
+                continue
+            repo = self.by_wd.get(wd)
+            if repo is None:
+                continue
+            if mask & IN_IGNORED:
+                repo.wds.pop(wd, None)
+                self.by_wd.pop(wd, None)
+                continue
+            repo.changed = True
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name != ".git":
+                path = os.path.join(repo.wds[wd], name)
+                dirs = self.tree_dirs(path, self.max_watches - self.watches)
+                if dirs is None:
+                    # Grew past the budget: stop vouching for this repo
+                    self.drop_repo(repo.name)
+                    self.too_large.add(repo.name)
+                    continue
+                for sub in dirs:
+                    self.watch_dir(repo, sub)
+        for repo in list(self.repos.values()):
+            if repo.changed:
+                self.publish(repo)
+
+    def expire(self) -> None:
+        cutoff = time.time() - self.idle
+        for name in list(self.repos):
+            if self.last_used(name) < cutoff:
+                self.drop_repo(name)
+
+    def shells_alive(self) -> bool:
+        alive = False
+        for path in self.shell_dir.iterdir():
+            try:
+                os.kill(int(path.name), 0)
+                alive = True
+            except (ValueError, ProcessLookupError):
+                path.unlink(missing_ok=True)
+            except PermissionError:
+                alive = True
+        return alive
+
+    def shutdown(self) -> None:
+        for name in list(self.repos):
+            self.drop_repo(name)
+        for path in self.gen_dir.iterdir():
+            path.unlink(missing_ok=True)
+
+    def run(self) -> None:
+        self.scan_wants()
+        last_tick = time.monotonic()
+        try:
+            while True:
+                ready, _, _ = select.select([self.inotify.fd], [], [], TICK)
+                if ready:
+                    self.handle(self.inotify.read())
+                if time.monotonic() - last_tick >= TICK:
+                    last_tick = time.monotonic()
+                    if not self.shells_alive():
+                        return
+                    self.expire()
+        finally:
+            self.shutdown()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--state", required=True, help="state directory shared with the shells")
+    parser.add_argument("--max-watches", type=int, default=8192, help="inotify watches across all repos")
+    parser.add_argument("--idle", type=float, default=600, help="drop repos unused for this many seconds")
+    args = parser.parse_args()
+
+    state = pathlib.Path(args.state).resolve()
+    state.mkdir(parents=True, exist_ok=True)
+    lock = open(state / "watcher.lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return 0  # another watcher already serves this user
+    (state / "watcher.pid").write_text(f"{os.getpid()}\n", encoding="utf-8")
+    try:
+        Watcher(state, args.max_watches, args.idle).run()
+    except WatcherError as err:
+        print(f"zpe: git watcher: {err}", file=sys.stderr)
+        return 1
+    finally:
+        (state / "watcher.pid").unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
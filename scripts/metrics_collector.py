@@ -0,0 +1,297 @@
+"""
+Per-user collector of host metrics shared by every prompt on the machine.
+
+Every --interval seconds the collector samples load (/proc/loadavg), CPU use
+(/proc/stat, over the last interval), memory use (/proc/meminfo), disk use of
+each local mount and the batteries under /sys/class/power_supply, found and
+read as modules/battery.zsh does (type Battery but not scope Device, one
+uevent per battery, rediscovered every --discovery-ttl seconds). It writes
+them to <state>/snapshot as one fixed-layout record (LAYOUT below), replaced
+atomically. Shells read fields by offset, so reading a snapshot needs no
+parsing and no process. src/collector.zsh mirrors the offsets.
+
+Shells register by creating readers/<pid> in the state directory and touch it
+when they read the snapshot. The collector exits once no registered shell is
+alive or none has read the snapshot for --idle seconds, removing the snapshot
+so nobody reads stale values. The state directory must be the user's own,
+with mode 700. Linux only.
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import os
+import pathlib
+import stat
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+MAGIC = b"ZPM3"
+# Every field is ASCII, left-aligned and space-padded to its width
+LAYOUT = struct.Struct(
+    "4s"    # magic
+    "12s"   # time of the sample, epoch seconds
+    "8s"    # 1-minute load average
+    "6s"    # CPU use, percent
+    "6s"    # memory use, percent
+    "4s"    # battery capacity, percent (blank without a battery)
+    "12s"   # battery status: Charging, Discharging, Full, ...
+    "3s"    # number of mount slots in use
+    "6s"    # minutes until the batteries are empty (blank unless discharging)
+)
+MOUNT = struct.Struct(
+    "6s"    # disk use, percent
+    "20s"   # device id (st_dev), which shells compare with that of $PWD
+    "102s"  # mount point
+)
+MAX_MOUNTS = 16
+SNAPSHOT_SIZE = LAYOUT.size + MAX_MOUNTS * MOUNT.size
+
+# Pseudo and network filesystems: no meaningful usage, or statvfs may hang
+SKIP_FSTYPES = {
+    "autofs", "binfmt_misc", "bpf", "cgroup", "cgroup2", "configfs", "debugfs", "devpts", "devtmpfs",
+    "fusectl", "hugetlbfs", "mqueue", "nsfs", "proc", "pstore", "securityfs", "squashfs", "sysfs",
+    "tracefs", "rpc_pipefs", "nfs", "nfs4", "cifs", "smbfs", "smb3", "fuse.sshfs", "9p",
+}
+POWER_SUPPLY = pathlib.Path("/sys/class/power_supply")
+
+
+def field(value: str, width: int) -> bytes:
+    return value.encode("utf-8", "replace")[:width].ljust(width)
+
+
+def number(value: Optional[str]) -> int:
+    """An integer sysfs value, 0 when missing or malformed (as zsh arithmetic on "" gives)."""
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+def read_text(path: pathlib.Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding="utf-8", errors="replace").strip()
+    except OSError:
+        return None
+
+
+class Sampler:
+    def __init__(
+        self, proc: pathlib.Path = pathlib.Path("/proc"), power: pathlib.Path = POWER_SUPPLY,
+        discovery_ttl: float = 600,
+    ) -> None:
+        self.proc = proc
+        self.power = power
+        self.discovery_ttl = discovery_ttl
+        self.batteries: List[pathlib.Path] = []
+        self.found_at: Optional[float] = None
+        self.last_cpu: Optional[Tuple[int, int]] = None
+
+    def load(self) -> str:
+        text = read_text(self.proc / "loadavg")
+        return text.split()[0] if text else ""
+
+    def cpu(self) -> str:
+        """Busy percentage since the previous call; blank on the first."""
+        text = read_text(self.proc / "stat")
+        if not text:
+            return ""
+        values = [int(v) for v in text.splitlines()[0].split()[1:]]
+        idle = values[3] + (values[4] if len(values) > 4 else 0)
+        total = sum(values[:8])
+        previous, self.last_cpu = self.last_cpu, (total, idle)
+        if previous is None or total <= previous[0]:
+            return ""
+        busy = (total - previous[0]) - (idle - previous[1])
+        return f"{100.0 * busy / (total - previous[0]):.1f}"
+
+    def memory(self) -> str:
+        text = read_text(self.proc / "meminfo")
+        if not text:
+            return ""
+        info: Dict[str, int] = {}
+        for line in text.splitlines():
+            key, _, rest = line.partition(":")
+            info[key] = int(rest.split()[0]) if rest.split() else 0
+        total = info.get("MemTotal", 0)
+        available = info.get("MemAvailable", info.get("MemFree", 0))
+        return f"{100.0 * (total - available) / total:.1f}" if total else ""
+
+    def mounts(self) -> List[Tuple[str, str, str]]:
+        """(mount point, use percent, device id) for local mounts, as df computes it."""
+        text = read_text(self.proc / "self" / "mounts") or ""
+        seen = set()
+        result = []
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) < 3 or parts[2] in SKIP_FSTYPES:
+                continue
+            point = parts[1].replace("\\040", " ")
+            if point in seen or len(point.encode()) > 102:
+                continue
+            seen.add(point)
+            try:
+                st = os.statvfs(point)
+                device = os.stat(point).st_dev
+            except OSError:
+                continue
+            used = st.f_blocks - st.f_bfree
+            if st.f_blocks == 0 or used + st.f_bavail == 0:
+                continue
+            result.append((point, f"{100.0 * used / (used + st.f_bavail):.1f}", str(device)))
+        result.sort(key=lambda item: (len(item[0]), item[0]))
+        return result[:MAX_MOUNTS]
+
+    def battery_paths(self) -> List[pathlib.Path]:
+        """System batteries, rediscovered every discovery_ttl seconds; as modules/battery.zsh."""
+        if self.found_at is None or time.monotonic() - self.found_at >= self.discovery_ttl:
+            found = []
+            for supply in sorted(self.power.iterdir()) if self.power.is_dir() else []:
+                # Device batteries (mice, headsets) report scope=Device
+                if read_text(supply / "type") == "Battery" and read_text(supply / "scope") != "Device":
+                    found.append(supply)
+            self.batteries, self.found_at = found, time.monotonic()
+        return self.batteries
+
+    def battery(self) -> Tuple[str, str, str]:
+        """(capacity, status, minutes to empty) over all batteries, weighted by their energy.
+
+        One uevent read per battery, combined exactly as zpe__battery_read does.
+        """
+        now = full = rate = capacity = counted = 0
+        mixed = False
+        unit = ""
+        statuses: List[str] = []
+        for bat in self.battery_paths():
+            text = read_text(bat / "uevent")
+            if text is None:
+                continue
+            event: Dict[str, str] = {}
+            for line in text.splitlines():
+                key, _, value = line.partition("=")
+                event[key[len("POWER_SUPPLY_"):] if key.startswith("POWER_SUPPLY_") else key] = value
+            if event.get("STATUS"):
+                statuses.append(event["STATUS"])
+            if event.get("CAPACITY"):
+                capacity += number(event["CAPACITY"])
+                counted += 1
+            # Energy (µWh, µW) or charge (µAh, µA); combining needs one unit for all
+            if event.get("ENERGY_FULL") and unit != "charge":
+                unit = "energy"
+                now += number(event.get("ENERGY_NOW"))
+                full += number(event["ENERGY_FULL"])
+                rate += number(event.get("POWER_NOW"))
+            elif event.get("CHARGE_FULL") and unit != "energy":
+                unit = "charge"
+                now += number(event.get("CHARGE_NOW"))
+                full += number(event["CHARGE_FULL"])
+                rate += number(event.get("CURRENT_NOW"))
+            else:
+                mixed = True
+        if not counted and not full:
+            return "", "", ""
+        if full > 0 and (not mixed or not counted):
+            percent = (now * 100 + full // 2) // full
+        else:
+            percent = (capacity + counted // 2) // counted
+        if "Charging" in statuses:
+            return str(percent), "Charging", ""
+        if "Discharging" in statuses:
+            minutes = str(now * 60 // rate) if rate > 0 and not mixed else ""
+            return str(percent), "Discharging", minutes
+        return str(percent), statuses[0] if statuses else "", ""
+
+    def snapshot(self, now: float) -> bytes:
+        capacity, status, minutes = self.battery()
+        mounts = self.mounts()
+        record = LAYOUT.pack(
+            MAGIC, field(str(int(now)), 12), field(self.load(), 8), field(self.cpu(), 6),
+            field(self.memory(), 6), field(capacity, 4), field(status, 12), field(str(len(mounts)), 3),
+            field(minutes, 6),
+        )
+        slots = [MOUNT.pack(field(percent, 6), field(device, 20), field(point, 102)) for point, percent, device in mounts]
+        slots += [MOUNT.pack(field("", 6), field("", 20), field("", 102))] * (MAX_MOUNTS - len(mounts))
+        return record + b"".join(slots)
+
+
+class Collector:
+    def __init__(self, state: pathlib.Path, interval: float, idle: float, sampler: Optional[Sampler] = None) -> None:
+        self.state = state
+        self.readers = state / "readers"
+        self.readers.mkdir(parents=True, exist_ok=True)
+        self.snapshot = state / "snapshot"
+        self.interval = interval
+        self.idle = idle
+        self.sampler = sampler or Sampler()
+
+    def write(self) -> None:
+        tmp = self.state / ".snapshot.tmp"
+        tmp.write_bytes(self.sampler.snapshot(time.time()))
+        os.replace(tmp, self.snapshot)
+
+    def readers_active(self) -> bool:
+        """Whether a live shell has read the snapshot within --idle seconds."""
+        cutoff = time.time() - self.idle
+        active = False
+        for path in self.readers.iterdir():
+            try:
+                os.kill(int(path.name), 0)
+            except (ValueError, ProcessLookupError):
+                path.unlink(missing_ok=True)
+                continue
+            except PermissionError:
+                pass
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    active = True
+            except FileNotFoundError:
+                continue
+        return active
+
+    def run(self) -> None:
+        try:
+            while True:
+                self.write()
+                time.sleep(self.interval)
+                if not self.readers_active():
+                    return
+        finally:
+            self.snapshot.unlink(missing_ok=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--state", required=True, help="state directory shared with the shells")
+    parser.add_argument("--interval", type=float, default=2, help="seconds between samples")
+    parser.add_argument("--idle", type=float, default=60, help="exit when no shell read the snapshot for this long")
+    parser.add_argument("--discovery-ttl", type=float, default=600, help="seconds before looking for batteries again")
+    args = parser.parse_args()
+
+    # Shells put the snapshot in their prompt: it must be ours alone
+    os.umask(0o077)
+    state = pathlib.Path(args.state)
+    state.mkdir(parents=True, exist_ok=True)
+    st = os.lstat(state)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+        print(f"zpe: metrics collector: {state} is not a private directory of this user", file=sys.stderr)
+        return 1
+    lock = open(state / "collector.lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return 0  # another collector already serves this user
+    (state / "collector.pid").write_text(f"{os.getpid()}\n", encoding="utf-8")
+    try:
+        Collector(state, max(args.interval, 0.1), args.idle, Sampler(discovery_ttl=args.discovery_ttl)).run()
+    except OSError as err:
+        print(f"zpe: metrics collector: {err}", file=sys.stderr)
+        return 1
+    finally:
+        (state / "collector.pid").unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,596 @@
+"""
+Per-user prompt daemon serving segments to every shell over a Unix socket.
+
+A shell sends one request per prompt: its directory, the variables listed in
+daemon.env and the modules it wants from the daemon. Each module with a
+provider is computed in a thread pool, all of them concurrently, and the
+answers go back in request order. Results are cached across shells under the
+provider's policy: a key (the directory, the repository, or nothing) plus
+request variables, the stat signature of the files it watches, and an
+optional maximum age. Identical requests in flight share one computation.
+
+Wire format, all fields NUL-terminated. Request: "ZPE1", then "key=value"
+fields (config, pwd, budget_ms, modules as a space-separated list, env.NAME
+for each variable), then an empty field. Reply: one field per module, "+"
+followed by the segment, or "-" when the shell should render the module
+itself (no provider, the provider declined, or no result within budget_ms
+and nothing cached).
+
+Providers for git and kubectl are built in; daemon.providers lists Python
+files whose register(providers) function adds more with providers.add().
+The daemon exits after --idle seconds without a request. Config comes from
+scripts/config_loader.py, re-read when the file changes.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import fcntl
+import functools
+import importlib.util
+import json
+import os
+import pathlib
+import struct
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+import commit_graph  # noqa: E402
+import config_loader  # noqa: E402
+
+MAGIC = "ZPE1"
+Config = Dict[str, Any]
+Signature = Tuple[Optional[Tuple[int, int, int]], ...]
+
+
+@dataclass
+class Request:
+    config: str
+    pwd: str
+    modules: List[str]
+    env: Dict[str, str]
+    budget_ms: int
+    memo: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, data: bytes) -> "Request":
+        fields = data.decode("utf-8", "surrogateescape").split("\0")
+        if not fields or fields[0] != MAGIC:
+            raise ValueError("not a prompt request")
+        values: Dict[str, str] = {}
+        env: Dict[str, str] = {}
+        for item in fields[1:]:
+            if not item:
+                break
+            key, _, value = item.partition("=")
+            if key.startswith("env."):
+                env[key[4:]] = value
+            else:
+                values[key] = value
+        return cls(
+            config=values.get("config", ""),
+            pwd=values.get("pwd", "/"),
+            modules=values.get("modules", "").split(),
+            env=env,
+            budget_ms=int(values.get("budget_ms") or 300),
+        )
+
+
+def by_directory(request: Request) -> Optional[str]:
+    return request.pwd
+
+
+@dataclass
+class Provider:
+    """A module computed by the daemon, and how long its segment stays valid."""
+
+    name: str
+    compute: Callable[[Request, Config], Optional[str]]  # None: the shell renders it
+    scope: Callable[[Request], Optional[str]] = by_directory  # None: don't cache
+    env: Tuple[str, ...] = ()  # request variables that are part of the key
+    watch: Callable[[Request], Iterable[str]] = lambda request: ()  # files whose stat validates an entry
+    ttl: Optional[float] = None  # seconds an entry may be reused; None: while its signature holds
+
+    def max_age(self, conf: Config) -> Optional[float]:
+        return self.ttl
+
+
+class Providers(Dict[str, Provider]):
+    def add(self, name: str, compute: Callable[[Request, Config], Optional[str]], **policy: Any) -> Provider:
+        provider = Provider(name, compute, **policy)
+        self[name] = provider
+        return provider
+
+
+def stat_sig(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def color(conf: Config, role: str, fallback: str) -> str:
+    return f"%F{{{conf.get('colors', {}).get(role) or fallback}}}"
+
+
+def read_text(path: pathlib.Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding="utf-8", errors="replace").strip()
+    except OSError:
+        return None
+
+
+# git ------------------------------------------------------------------------
+
+@dataclass
+class Repo:
+    root: pathlib.Path
+    gitdir: pathlib.Path
+    commondir: pathlib.Path
+    ref: str = ""
+    branch: str = ""
+    oid: str = ""
+    op: str = ""
+
+
+def find_repo(request: Request) -> Optional[Repo]:
+    """Work tree of request.pwd, as zpe__git_walk_root and zpe__git_resolve find it."""
+    if "repo" in request.memo:
+        return request.memo["repo"]
+    repo = None
+    # The physical path, as git resolves it: a symlink into a repo finds it
+    directory = pathlib.Path(os.path.realpath(request.pwd))
+    for candidate in (directory, *directory.parents):
+        dotgit = candidate / ".git"
+        if dotgit.is_dir():
+            gitdir = dotgit
+        elif dotgit.is_file():
+            line = read_text(dotgit) or ""
+            gitdir = (candidate / line.removeprefix("gitdir: ")).resolve()
+        else:
+            continue
+        common = read_text(gitdir / "commondir")
+        commondir = (gitdir / common).resolve() if common else gitdir
+        repo = Repo(candidate, gitdir, commondir)
+        resolve_head(repo)
+        break
+    request.memo["repo"] = repo
+    return repo
+
+
+def read_ref(commondir: pathlib.Path, ref: str) -> str:
+    loose = read_text(commondir / ref)
+    if loose:
+        return loose
+    for line in (read_text(commondir / "packed-refs") or "").splitlines():
+        if line.endswith(" " + ref):
+            return line.split(" ", 1)[0]
+    return ""
+
+
+def resolve_head(repo: Repo) -> None:
+    head = read_text(repo.gitdir / "HEAD") or ""
+    if head.startswith("ref: "):
+        repo.ref = head[5:]
+        repo.oid = read_ref(repo.commondir, repo.ref)
+        repo.branch = repo.ref.removeprefix("refs/heads/")
+    else:
+        repo.oid = head
+        repo.branch = head[:7]
+    gitdir = repo.gitdir
+    head_name = ""
+    if (gitdir / "rebase-merge").is_dir():
+        repo.op = "rebase-i" if (gitdir / "rebase-merge" / "interactive").is_file() else "rebase"
+        head_name = read_text(gitdir / "rebase-merge" / "head-name") or ""
+    elif (gitdir / "rebase-apply").is_dir():
+        if (gitdir / "rebase-apply" / "rebasing").is_file():
+            repo.op = "rebase"
+        elif (gitdir / "rebase-apply" / "applying").is_file():
+            repo.op = "am"
+        else:
+            repo.op = "am/rebase"
+        head_name = read_text(gitdir / "rebase-apply" / "head-name") or ""
+    else:
+        for name, op in (("MERGE_HEAD", "merge"), ("CHERRY_PICK_HEAD", "cherry-pick"),
+                         ("REVERT_HEAD", "revert"), ("BISECT_LOG", "bisect")):
+            if (gitdir / name).is_file():
+                repo.op = op
+                break
+    if head_name.startswith("refs/heads/"):
+        repo.branch = head_name[len("refs/heads/"):]
+
+
+def index_entries(gitdir: pathlib.Path) -> int:
+    try:
+        with open(gitdir / "index", "rb") as fh:
+            header = fh.read(12)
+    except OSError:
+        return 0
+    return int.from_bytes(header[8:12], "big") if header[:4] == b"DIRC" else 0
+
+
+def upstream_ref(repo: Repo) -> str:
+    """Upstream of the checked-out branch from the repository config, as zpe__git_upstream."""
+    if not repo.ref.startswith("refs/heads/"):
+        return ""
+    wanted = f'[branch "{repo.ref[len("refs/heads/"):]}"]'
+    section = remote = merge = ""
+    for line in (read_text(repo.commondir / "config") or "").splitlines():
+        line = line.strip()
+        key, _, value = line.partition("=")
+        if line.startswith("["):
+            section = line
+        elif section == wanted and key.strip() == "remote":
+            remote = value.strip()
+        elif section == wanted and key.strip() == "merge":
+            merge = value.strip()
+    if not remote or not merge.startswith("refs/heads/"):
+        return ""
+    return merge if remote == "." else f"refs/remotes/{remote}/{merge[len('refs/heads/'):]}"
+
+
+@functools.lru_cache(maxsize=1024)
+def ahead_behind(commondir: str, left: str, right: str, max_walk: int) -> Optional[Tuple[int, int, bool]]:
+    """
+    Commits ahead and behind, and whether the walk completed, from
+    scripts/commit_graph.py like the shell module, else `git rev-list`.
+    Commits never change, so results are cached per pair.
+    """
+    objects = pathlib.Path(commondir) / "objects"
+    try:
+        source = commit_graph.CommitSource(objects, commit_graph.CommitGraph.open(objects))
+        return commit_graph.ahead_behind(source, bytes.fromhex(left), bytes.fromhex(right), max_walk)
+    except (commit_graph.CommitGraphError, OSError, ValueError, struct.error):
+        pass
+    try:
+        out = subprocess.run(["git", "--git-dir", commondir, "rev-list", "--left-right", "--count", f"{left}...{right}"],
+                             capture_output=True, text=True, timeout=30)
+        ahead, behind = map(int, out.stdout.split())
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+    return ahead, behind, True
+
+
+def parse_status(out: str) -> Dict[str, int]:
+    """Counts from `git status --porcelain=v2 -z`, as zpe__git_parse_status."""
+    counts = dict(added=0, modified=0, deleted=0)
+    entries = iter(out.split("\0"))
+    for entry in entries:
+        if entry[:2] in ("1 ", "2 "):
+            xy = entry[2:4]
+            if "M" in xy:
+                counts["modified"] += 1
+            elif "A" in xy:
+                counts["added"] += 1
+            elif "D" in xy:
+                counts["deleted"] += 1
+            if entry[0] == "2":
+                next(entries, None)  # the rename's original path
+    return counts
+
+
+def git_segment(request: Request, conf: Config) -> Optional[str]:
+    git = conf.get("git", {})
+    # Options only the shell module implements: leave those repos to it
+    if git.get("scope", "repo") != "repo" or git.get("engine", "status") != "status":
+        return None
+    if not (git.get("show_branch") or git.get("show_status")):
+        return ""
+    repo = find_repo(request)
+    if repo is None or not repo.branch:
+        return ""
+    threshold = int(git.get("large_repo_threshold") or 0)
+    if threshold > 0 and index_entries(repo.gitdir) >= threshold:
+        return None
+
+    branch = repo.branch
+    max_len = int(git.get("max_branch_len") or 0)
+    if 0 < max_len < len(branch):
+        branch = branch[:max_len - 1] + "…"
+    seg = f"git:{branch}"
+    if repo.op:
+        seg += f"|{repo.op}"
+
+    counts: Dict[str, int] = {}
+    if git.get("show_status"):
+        # Ahead/behind comes from the bounded walk below, never from status
+        argv = ["git"] + (["--no-optional-locks"] if git.get("read_only") else [])
+        argv += ["status", "--porcelain=v2", "-z"]
+        try:
+            out = subprocess.run(argv, cwd=request.pwd, capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if out.returncode == 0:
+            counts = parse_status(out.stdout)
+
+    extra = []
+    upstream = upstream_ref(repo) if git.get("show_ahead_behind") and repo.oid else ""
+    upstream_oid = read_ref(repo.commondir, upstream) if upstream else ""
+    ab = ahead_behind(str(repo.commondir), repo.oid, upstream_oid,
+                      int(git.get("ahead_behind_max_walk") or 10000)) if upstream_oid else None
+    if ab:
+        ahead, behind, complete = ab
+        # A walk cut short by ahead_behind_max_walk gives lower bounds
+        more = "" if complete else "+"
+        if ahead > 0:
+            extra.append(f"⇡{ahead}{more}")
+        if behind > 0:
+            extra.append(f"⇣{behind}{more}")
+    if git.get("show_stash"):
+        stash = read_text(repo.commondir / "logs" / "refs" / "stash")
+        entries = len([line for line in (stash or "").splitlines() if line])
+        if entries:
+            extra.append(f"≡{entries}")
+    if extra:
+        seg += " " + "".join(extra)
+    if git.get("show_status") and counts:
+        parts = [f"{sign}{counts[key]}" for sign, key in (("+", "added"), ("~", "modified"), ("-", "deleted"))
+                 if counts[key] > 0]
+        if parts:
+            seg += " " + " ".join(parts)
+    return f"{color(conf, 'accent', 'magenta')}{seg}%f"
+
+
+def git_scope(request: Request) -> Optional[str]:
+    repo = find_repo(request)
+    return str(repo.root) if repo else request.pwd
+
+
+def git_watch(request: Request) -> List[str]:
+    """The files zpe__git_signature stats, plus the stash reflog."""
+    repo = find_repo(request)
+    if repo is None:
+        return [request.pwd]
+    files = [repo.gitdir / "index", repo.gitdir / "HEAD"]
+    if repo.ref:
+        files += [repo.commondir / repo.ref, repo.commondir / "packed-refs"]
+    files += [repo.commondir / "logs" / "refs" / "stash", repo.root, pathlib.Path(request.pwd)]
+    return [str(path) for path in files]
+
+
+class GitProvider(Provider):
+    def max_age(self, conf: Config) -> Optional[float]:
+        # The signature misses edits to tracked files; git.cache_max_age bounds that
+        return float(conf.get("git", {}).get("cache_max_age") or 0)
+
+
+# kubectl --------------------------------------------------------------------
+
+def kube_files(request: Request) -> List[str]:
+    files = list(dict.fromkeys(part for part in request.env.get("KUBECONFIG", "").split(":") if part))
+    return files or [os.path.expanduser("~/.kube/config")]
+
+
+def load_kubeconfig(path: str) -> Optional[Dict[str, Any]]:
+    text = read_text(pathlib.Path(path))
+    if not text:
+        return None
+    if text.startswith("{"):
+        return json.loads(text)
+    if config_loader.yaml is None:
+        raise ValueError("pyyaml is required to read kubeconfig files")
+    data = config_loader.yaml.safe_load(text)
+    return data if isinstance(data, dict) else None
+
+
+def kubectl_segment(request: Request, conf: Config) -> Optional[str]:
+    """Current context and namespace; first file wins, as in kubectl."""
+    try:
+        configs = [data for data in map(load_kubeconfig, kube_files(request)) if data]
+    except ValueError:
+        return None
+    context = next((data["current-context"] for data in configs if data.get("current-context")), "")
+    if not context:
+        return ""
+    namespace = ""
+    for data in configs:
+        match = [item for item in data.get("contexts") or [] if item.get("name") == context]
+        if match:
+            namespace = (match[0].get("context") or {}).get("namespace") or ""
+            break
+    seg = f"k8s:{context}"
+    if conf.get("kubectl", {}).get("show_namespace") and namespace:
+        seg += f"/{namespace}"
+    return f"{color(conf, 'accent', 'magenta')}{seg}%f"
+
+
+def builtin_providers() -> Providers:
+    providers = Providers()
+    providers["git"] = GitProvider("git", git_segment, scope=git_scope, watch=git_watch)
+    providers.add("kubectl", kubectl_segment, scope=lambda request: "", env=("KUBECONFIG",), watch=kube_files)
+    return providers
+
+
+def load_providers(providers: Providers, paths: Iterable[str]) -> None:
+    for path in paths:
+        path = os.path.expanduser(path)
+        spec = importlib.util.spec_from_file_location(f"zpe_provider_{pathlib.Path(path).stem}", path)
+        if spec is None or spec.loader is None:
+            raise config_loader.ConfigError(f"cannot load provider file {path}")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.register(providers)
+
+
+# daemon ---------------------------------------------------------------------
+
+@dataclass
+class Entry:
+    signature: Signature
+    value: Optional[str]
+    created: float
+
+
+class Daemon:
+    def __init__(self, providers: Providers, cache_size: int = 512, workers: int = 8, idle: float = 600) -> None:
+        self.providers = providers
+        self.cache: "collections.OrderedDict[tuple, Entry]" = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.configs: Dict[str, Tuple[Optional[Tuple[int, int, int]], Config]] = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zpe-provider")
+        self.idle = idle
+        self.last_request = time.monotonic()
+        self.stats = dict(requests=0, hits=0, misses=0, coalesced=0, stale=0, late=0)
+
+    def config(self, path: str) -> Config:
+        """The shell's config, re-read when its file changes; defaults without one."""
+        sig = stat_sig(path) if path else None
+        known = self.configs.get(path)
+        if known and known[0] == sig:
+            return known[1]
+        try:
+            conf = config_loader.load_config(pathlib.Path(path)) if sig else config_loader.DEFAULTS
+        except (config_loader.ConfigError, ValueError) as err:
+            print(f"zpe: prompt daemon: {err}", file=sys.stderr)
+            conf = known[1] if known else config_loader.DEFAULTS
+        self.configs[path] = (sig, conf)
+        # Segments depend on the config; forget those built under the old one
+        for key in [key for key in self.cache if key[1] == path]:
+            del self.cache[key]
+        return conf
+
+    def inputs(self, provider: Provider, request: Request) -> Tuple[Optional[tuple], Signature]:
+        scope = provider.scope(request)
+        signature = tuple(stat_sig(path) for path in provider.watch(request))
+        if scope is None:
+            return None, signature
+        env = tuple(request.env.get(name) for name in provider.env)
+        return (provider.name, request.config, scope, env), signature
+
+    def remember(self, key: tuple, entry: Entry) -> None:
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def segment(self, provider: Provider, request: Request, conf: Config, deadline: float) -> str:
+        loop = asyncio.get_running_loop()
+        key, signature = await loop.run_in_executor(self.pool, self.inputs, provider, request)
+        entry = self.cache.get(key) if key else None
+        if entry is not None and entry.signature == signature:
+            max_age = provider.max_age(conf)
+            if max_age is None or time.monotonic() - entry.created < max_age:
+                self.cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return "-" if entry.value is None else "+" + entry.value
+
+        flight = (key, signature) if key else None
+        task = self.inflight.get(flight) if flight else None
+        if task is None:
+            self.stats["misses"] += 1
+            started = time.monotonic()
+            task = loop.run_in_executor(self.pool, provider.compute, request, conf)
+            if flight:
+                self.inflight[flight] = task
+                task.add_done_callback(lambda done: self.finished(flight, started, done))
+        else:
+            self.stats["coalesced"] += 1
+        try:
+            value = await asyncio.wait_for(asyncio.shield(task), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            # Still computing: the cache gets the result for the next prompt
+            self.stats["late"] += 1
+            if entry is None or entry.value is None:
+                return "-"
+            self.stats["stale"] += 1
+            marker = conf.get("prompt", {}).get("stale_marker", "?")
+            return f"+{entry.value}{color(conf, 'muted', 'white')}{marker}%f"
+        except Exception as err:  # a provider failing must not take the others down
+            print(f"zpe: prompt daemon: {provider.name}: {err}", file=sys.stderr)
+            return "-"
+        return "-" if value is None else "+" + value
+
+    def finished(self, flight: tuple, started: float, done: asyncio.Future) -> None:
+        self.inflight.pop(flight, None)
+        if not done.cancelled() and done.exception() is None:
+            self.remember(flight[0], Entry(flight[1], done.result(), started))
+
+    async def answer(self, request: Request) -> List[str]:
+        self.stats["requests"] += 1
+        conf = self.config(request.config)
+        deadline = time.monotonic() + request.budget_ms / 1000 * 0.8
+        jobs = []
+        for name in request.modules:
+            provider = self.providers.get(name)
+            jobs.append(self.segment(provider, request, conf, deadline) if provider else asyncio.sleep(0, "-"))
+        return list(await asyncio.gather(*jobs))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.last_request = time.monotonic()
+        try:
+            request = Request.parse(await reader.readuntil(b"\0\0"))
+            fields = await self.answer(request)
+            writer.write("".join(f"{item}\0" for item in fields).encode("utf-8", "surrogateescape"))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: pathlib.Path) -> None:
+        # Created owner-only from the start; a chmod after bind leaves a window
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=str(socket_path))
+        finally:
+            os.umask(umask)
+        try:
+            while time.monotonic() - self.last_request < self.idle:
+                await asyncio.sleep(min(self.idle, 5))
+        finally:
+            server.close()
+            await server.wait_closed()
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", required=True, help="Unix socket to listen on")
+    parser.add_argument("--config", default="", help="config whose daemon section and providers to use")
+    parser.add_argument("--idle", type=float, default=600, help="exit after this many seconds without a request")
+    args = parser.parse_args()
+
+    socket_path = pathlib.Path(args.socket)
+    socket_path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+    lock = open(f"{socket_path}.lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return 0  # another daemon already serves this user
+    socket_path.unlink(missing_ok=True)
+
+    providers = builtin_providers()
+    try:
+        conf = config_loader.load_config(pathlib.Path(args.config)) if args.config else config_loader.DEFAULTS
+        daemon_conf = conf.get("daemon", {})
+        load_providers(providers, daemon_conf.get("providers", []))
+    except Exception as err:
+        print(f"zpe: prompt daemon: {err}", file=sys.stderr)
+        return 1
+    daemon = Daemon(
+        providers,
+        cache_size=int(daemon_conf.get("cache_size", 512)),
+        workers=int(daemon_conf.get("workers", 8)),
+        idle=args.idle,
+    )
+    try:
+        asyncio.run(daemon.serve(socket_path))
+    except OSError as err:
+        print(f"zpe: prompt daemon: {err}", file=sys.stderr)
+        return 1
+    finally:
+        socket_path.unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
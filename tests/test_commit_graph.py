@@ -0,0 +1,95 @@
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+import commit_graph as cg  # type: ignore # noqa: E402
+
+GIT_ID = ["-c", "user.name=zpe", "-c", "user.email=zpe@example.invalid"]
+
+
+class CommitGraphTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = pathlib.Path(self.tmp.name)
+        self.git("init", "-q", "-b", "main")
+        self.commits("base", 5)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def git(self, *args: str) -> str:
+        return subprocess.run(
+            ["git", "-C", str(self.repo), *GIT_ID, *args], check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    def commits(self, label: str, count: int) -> None:
+        for i in range(count):
+            self.git("commit", "-q", "--allow-empty", "-m", f"{label} {i}")
+
+    def expected(self, left: str, right: str) -> tuple:
+        ahead, behind = self.git("rev-list", "--left-right", "--count", f"{left}...{right}").split()
+        return int(ahead), int(behind)
+
+    def counts(self, left: str, right: str, max_walk: int = 10000) -> tuple:
+        objects = self.repo / ".git" / "objects"
+        source = cg.CommitSource(objects, cg.CommitGraph.open(objects))
+        return cg.ahead_behind(source, bytes.fromhex(self.git("rev-parse", left)), bytes.fromhex(self.git("rev-parse", right)), max_walk)
+
+    def diverge(self) -> None:
+        self.git("branch", "upstream")
+        self.commits("local", 3)
+        self.git("checkout", "-q", "upstream")
+        self.commits("remote", 4)
+        self.git("checkout", "-q", "main")
+
+    def test_counts_match_rev_list(self) -> None:
+        self.diverge()
+        self.git("commit-graph", "write", "--reachable")
+        self.assertEqual(self.counts("main", "upstream"), (*self.expected("main", "upstream"), True))
+        self.assertEqual(self.counts("main", "main"), (0, 0, True))
+
+    def test_commits_newer_than_the_graph_come_from_loose_objects(self) -> None:
+        self.git("commit-graph", "write", "--reachable")
+        self.diverge()
+        self.assertEqual(self.counts("main", "upstream"), (3, 4, True))
+
+    def test_split_chain_and_merges(self) -> None:
+        self.diverge()
+        self.git("commit-graph", "write", "--reachable", "--split")
+        self.git("merge", "-q", "--no-edit", "upstream")
+        for side in ("side1", "side2"):
+            self.git("checkout", "-q", "-b", side, "upstream~1")
+            self.commits(side, 2)
+        self.git("checkout", "-q", "main")
+        # Octopus merge: parents beyond the second live in the EDGE chunk
+        self.git("merge", "-q", "--no-edit", "side1", "side2")
+        self.assertEqual(len(self.git("log", "-1", "--format=%p").split()), 3)
+        self.commits("after", 2)
+        self.git("commit-graph", "write", "--reachable", "--split=no-merge")
+        chain = self.repo / ".git" / "objects" / "info" / "commit-graphs" / "commit-graph-chain"
+        self.assertEqual(len(chain.read_text().split()), 2)
+        self.assertEqual(self.counts("main", "upstream")[:2], self.expected("main", "upstream"))
+        self.assertEqual(self.counts("side2", "main")[:2], self.expected("side2", "main"))
+        self.assertEqual(self.counts("upstream~3", "side1")[:2], self.expected("upstream~3", "side1"))
+        self.assertIsNotNone(cg.CommitGraph.open(self.repo / ".git" / "objects").layers[-1].edges)
+
+    def test_walk_stops_at_max_walk(self) -> None:
+        self.diverge()
+        self.git("commit-graph", "write", "--reachable")
+        ahead, behind, complete = self.counts("main", "upstream", max_walk=2)
+        self.assertFalse(complete)
+        self.assertLessEqual(ahead + behind, 2)
+
+    def test_missing_graph_is_an_error(self) -> None:
+        with self.assertRaises(cg.CommitGraphError):
+            cg.CommitGraph.open(self.repo / ".git" / "objects")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -40,7 +40,25 @@ show_status = false
 
         payload = cl.build_shell_payload(config)
         self.assertIn('ZPE_SEPARATOR="::"', payload)
-        self.assertIn('ZPE_GIT_CONF["show_status"]="False"', payload)
+        self.assertIn('ZPE_GIT_CONF["show_status"]="false"', payload)
+
+    def test_payload_escapes_expansions(self) -> None:
+        payload = cl.build_shell_payload(cl.merge(cl.DEFAULTS, {"prompt": {"separator": "$(x) `y`"}}))
+        self.assertIn('ZPE_SEPARATOR="\\$(x) \\`y\\`"', payload)
+
+    def test_shipped_config_matches_defaults(self) -> None:
+        # zpe_load_config skips Python for config/default.toml, so it must equal DEFAULTS
+        self.assertEqual(cl.load_config(ROOT / "config" / "default.toml"), cl.DEFAULTS)
+
+    def test_zsh_defaults_block_is_in_sync(self) -> None:
+        text = (ROOT / "src" / "zpe.zsh").read_text(encoding="utf-8")
+        self.assertIn(cl.render_defaults_block(), text, "run `make defaults` to regenerate")
+
+    def test_sync_defaults_block_rewrites_markers(self) -> None:
+        target = self.write_config(f"before\n{cl.DEFAULTS_BEGIN}\nstale\n{cl.DEFAULTS_END}\nafter\n", "zpe.zsh")
+        self.assertTrue(cl.sync_defaults_block(target))
+        self.assertEqual(target.read_text(encoding="utf-8"), f"before\n{cl.render_defaults_block()}after\n")
+        self.assertFalse(cl.sync_defaults_block(target))
 
     def test_cache_hit_skips_reload(self) -> None:
         path = self.write_config("[prompt]\nseparator = '::'\n")
@@ -56,6 +74,27 @@ show_status = false
         self.assertTrue(used_cache2)
         self.assertEqual(payload1, payload2)
 
+    def test_writes_sourceable_artifact_and_stamp(self) -> None:
+        path = self.write_config("[prompt]\nseparator = '::'\n")
+        cache_dir = self.tmp_path / "cache"
+
+        payload, _ = cl.load_config_cached(path, cache_dir)
+        artifact, stamp = cl.artifact_paths(path, cache_dir)
+
+        self.assertEqual(artifact.read_text(encoding="utf-8"), payload)
+        fields = dict(line.split("=", 1) for line in stamp.read_text(encoding="utf-8").splitlines())
+        st = path.stat()
+        self.assertEqual(fields["config"], str(path))
+        self.assertEqual(int(fields["mtime_ns"]), st.st_mtime_ns)
+        self.assertEqual(int(fields["size"]), st.st_size)
+        self.assertEqual(fields["defaults_hash"], cl.defaults_fingerprint())
+        self.assertEqual(int(fields["schema"]), cl.CACHE_SCHEMA)
+
+    def test_artifact_names_are_derived_from_path(self) -> None:
+        artifact, stamp = cl.artifact_paths(pathlib.Path("/home/me/zpe.toml"), self.tmp_path)
+        self.assertEqual(artifact.name, "home%me%zpe.toml.zsh")
+        self.assertEqual(stamp.name, "home%me%zpe.toml.stamp")
+
     def test_build_shell_payload_golden(self) -> None:
         """Golden test: verify expected shell assignments are emitted."""
         path = self.write_config(
@@ -94,8 +133,8 @@ frames = ["A", "B"]
         self.assertIn('typeset -ga ZPE_ART_FRAMES=("A" "B")', payload)
 
         # Check associative array entries
-        self.assertIn('ZPE_GIT_CONF["show_branch"]="True"', payload)
-        self.assertIn('ZPE_GIT_CONF["show_status"]="False"', payload)
+        self.assertIn('ZPE_GIT_CONF["show_branch"]="true"', payload)
+        self.assertIn('ZPE_GIT_CONF["show_status"]="false"', payload)
         self.assertIn('ZPE_GIT_CONF["max_branch_len"]="15"', payload)
 
 
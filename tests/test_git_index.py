@@ -0,0 +1,175 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+import git_index as gi  # type: ignore # noqa: E402
+
+GIT_ID = ["-c", "user.name=zpe", "-c", "user.email=zpe@example.invalid"]
+
+
+def git(repo: pathlib.Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), *GIT_ID, *args], check=True, capture_output=True, text=True
+    ).stdout
+
+
+def backdate(repo: pathlib.Path) -> None:
+    """Move every work tree mtime into the past so no entry is racily clean."""
+    for path in repo.rglob("*"):
+        if ".git" not in path.parts and path.is_file():
+            os.utime(path, (1_000_000_000, 1_000_000_000))
+
+
+class GitIndexTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = pathlib.Path(self.tmp.name)
+        git(self.repo, "init", "-q")
+        for name in ("a", "b", "c", "sub/d"):
+            path = self.repo / name
+            path.parent.mkdir(exist_ok=True)
+            path.write_text(f"{name}\n", encoding="utf-8")
+        backdate(self.repo)
+        git(self.repo, "add", "-A")
+        git(self.repo, "commit", "-q", "-m", "init")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def counts(self, **kwargs: object) -> dict:
+        return gi.count_changes(self.repo, **kwargs)  # type: ignore[arg-type]
+
+    def test_clean_repo_decides_everything_by_stat(self) -> None:
+        result = self.counts()
+        self.assertEqual((result["added"], result["modified"], result["deleted"]), (0, 0, 0))
+        self.assertEqual(result["entries"], 4)
+        self.assertEqual(result["undecided"], 0)
+
+    def test_counts_match_git_status(self) -> None:
+        (self.repo / "a").write_text("longer content\n", encoding="utf-8")
+        (self.repo / "sub" / "d").unlink()
+        (self.repo / "new").write_text("new\n", encoding="utf-8")
+        git(self.repo, "add", "new")
+        git(self.repo, "rm", "-q", "b")
+        result = self.counts()
+        self.assertEqual((result["added"], result["modified"], result["deleted"]), (1, 1, 2))
+        self.assertEqual((result["staged"], result["unstaged"]), (2, 2))
+
+    def test_index_v4_matches_v2(self) -> None:
+        (self.repo / "a").write_text("longer content\n", encoding="utf-8")
+        (self.repo / "c").unlink()
+        expected = self.counts()
+        git(self.repo, "update-index", "--index-version", "4")
+        self.assertEqual(bytes((self.repo / ".git" / "index").read_bytes()[4:8]), b"\0\0\0\4")
+        self.assertEqual(self.counts(), expected)
+
+    def test_same_size_touch_is_undecided_then_resolved_by_git(self) -> None:
+        os.utime(self.repo / "a")
+        (self.repo / "b").write_text("B\n", encoding="utf-8")
+        undecided = self.counts(fallback=False)
+        self.assertEqual(sorted(undecided["undecided_paths"]), ["a", "b"])
+        self.assertEqual(undecided["modified"], 0)
+        # git compares content: only b really changed
+        self.assertEqual(self.counts()["modified"], 1)
+
+    def test_conflicts_are_counted_separately(self) -> None:
+        base = git(self.repo, "rev-parse", "--abbrev-ref", "HEAD").strip()
+        git(self.repo, "checkout", "-q", "-b", "other")
+        (self.repo / "a").write_text("other\n", encoding="utf-8")
+        git(self.repo, "commit", "-q", "-am", "other")
+        git(self.repo, "checkout", "-q", base)
+        (self.repo / "a").write_text("mine\n", encoding="utf-8")
+        git(self.repo, "commit", "-q", "-am", "mine")
+        subprocess.run(["git", "-C", str(self.repo), *GIT_ID, "merge", "-q", "other"], capture_output=True)
+        result = self.counts()
+        self.assertEqual(result["conflicted"], 1)
+        self.assertEqual(result["modified"], 0)
+
+    def test_unborn_branch_counts_index_as_added(self) -> None:
+        fresh = self.repo / "fresh"
+        fresh.mkdir()
+        git(fresh, "init", "-q")
+        (fresh / "x").write_text("x\n", encoding="utf-8")
+        git(fresh, "add", "x")
+        self.assertEqual(gi.count_changes(fresh)["added"], 1)
+
+    def test_other_diff_index_failures_are_reported(self) -> None:
+        run_git = gi.run_git
+
+        def failing(root: pathlib.Path, args: list) -> str:
+            if args[0] == "diff-index":
+                raise gi.GitIndexError("fatal: index file corrupt")
+            return run_git(root, args)
+
+        with mock.patch.object(gi, "run_git", failing):
+            with self.assertRaises(gi.GitIndexError):
+                gi.staged_changes(self.repo, [])
+
+    def test_undecided_paths_are_not_patterns(self) -> None:
+        for name in ("a*", "[a]", ":a"):
+            (self.repo / name).write_text("x\n", encoding="utf-8")
+        git(self.repo, "add", "-A")
+        git(self.repo, "commit", "-q", "-m", "odd names")
+        (self.repo / "a").write_text("changed\n", encoding="utf-8")
+        self.assertEqual(gi.resolve_undecided(self.repo, ["a*", "[a]", ":a"]), {})
+        (self.repo / "a*").write_text("changed\n", encoding="utf-8")
+        self.assertEqual(gi.resolve_undecided(self.repo, ["a*", "[a]"]), {"a*": "M"})
+
+    def test_executable_bit_is_ignored_without_core_filemode(self) -> None:
+        (self.repo / "a").chmod(0o755)
+        self.assertEqual(self.counts()["modified"], 1)
+        git(self.repo, "config", "core.fileMode", "false")
+        result = self.counts()
+        self.assertEqual(result["modified"], 0)
+        self.assertEqual(git(self.repo, "status", "--porcelain"), "")
+
+    def test_changed_submodule_is_modified(self) -> None:
+        inner = self.repo / "mod"
+        inner.mkdir()
+        git(inner, "init", "-q")
+        (inner / "f").write_text("f\n", encoding="utf-8")
+        git(inner, "add", "f")
+        git(inner, "commit", "-q", "-m", "one")
+        git(self.repo, "add", "mod")
+        git(self.repo, "commit", "-q", "-m", "submodule")
+        self.assertEqual(self.counts()["modified"], 0)
+        (inner / "f").write_text("g\n", encoding="utf-8")
+        git(inner, "commit", "-q", "-am", "two")
+        self.assertEqual(self.counts()["modified"], 1)
+
+    def test_config_bool_reads_the_core_section(self) -> None:
+        text = "[core]\n\tfilemode = false ; set by init\n[other]\n\tsymlinks = false\n[core]\n\tsymlinks\n"
+        self.assertFalse(gi.config_bool(text, "core", "filemode", True))
+        self.assertTrue(gi.config_bool(text, "core", "symlinks", False))
+        self.assertTrue(gi.config_bool("", "core", "filemode", True))
+
+    def test_scope_limits_counts_to_a_subdirectory(self) -> None:
+        (self.repo / "a").write_text("longer content\n", encoding="utf-8")
+        (self.repo / "sub" / "d").write_text("longer content\n", encoding="utf-8")
+        (self.repo / "sub" / "e").write_text("e\n", encoding="utf-8")
+        git(self.repo, "add", "sub/e")
+        result = self.counts(scope="sub")
+        self.assertEqual((result["added"], result["modified"], result["entries"]), (1, 1, 2))
+
+    def test_rejects_non_index_data(self) -> None:
+        with self.assertRaises(gi.GitIndexError):
+            gi.parse_index(b"PACK\0\0\0\2\0\0\0\0")
+        with self.assertRaises(gi.GitIndexError):
+            gi.parse_index(b"DIRC\0\0\0\5\0\0\0\0")
+
+    def test_read_varint(self) -> None:
+        self.assertEqual(gi.read_varint(b"\x05", 0), (5, 1))
+        # git's offset encoding: 0x80 0x00 is 128, not 0
+        self.assertEqual(gi.read_varint(b"\x80\x00", 0), (128, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
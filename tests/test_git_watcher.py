@@ -0,0 +1,118 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from typing import Callable
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+WATCHER = ROOT / "scripts" / "git_watcher.py"
+
+
+def wait_for(predicate: Callable[[], bool], timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class GitWatcherTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base = pathlib.Path(self.tmp.name)
+        self.state = self.base / "state"
+        (self.state / "shells").mkdir(parents=True)
+        (self.state / "want").mkdir()
+        self.shell = self.state / "shells" / str(os.getpid())
+        self.shell.write_text("")
+        self.proc = None
+
+    def tearDown(self) -> None:
+        if self.proc and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.tmp.cleanup()
+
+    def start(self, *args: str) -> None:
+        self.proc = subprocess.Popen(
+            [sys.executable, str(WATCHER), "--state", str(self.state), *args],
+            stderr=subprocess.PIPE,
+        )
+        self.assertTrue(wait_for(lambda: (self.state / "watcher.pid").exists()))
+
+    def repo(self, name: str, dirs: int = 1) -> pathlib.Path:
+        root = self.base / name
+        subprocess.run(["git", "init", "-q", str(root)], check=True)
+        for i in range(dirs):
+            (root / f"d{i}").mkdir()
+            (root / f"d{i}" / "f.txt").write_text("x\n")
+        return root
+
+    def want(self, root: pathlib.Path) -> pathlib.Path:
+        name = str(root).replace("%", "%25").replace("/", "%2F")
+        (self.state / "want" / name).write_text(str(root))
+        return self.state / "gen" / name
+
+    def test_generation_advances_on_work_tree_changes(self) -> None:
+        root = self.repo("one")
+        self.start()
+        gen = self.want(root)
+        self.assertTrue(wait_for(gen.exists))
+        first = gen.read_text()
+        (root / "d0" / "f.txt").write_text("changed\n")
+        self.assertTrue(wait_for(lambda: gen.read_text() != first))
+        # New directories are watched too
+        second = gen.read_text()
+        (root / "new").mkdir()
+        self.assertTrue(wait_for(lambda: gen.read_text() != second))
+        third = gen.read_text()
+        (root / "new" / "g.txt").write_text("y\n")
+        self.assertTrue(wait_for(lambda: gen.read_text() != third))
+
+    def test_roots_with_percent_signs_are_watched_as_themselves(self) -> None:
+        # Under the old naming both were "...%a%b", and a%b was watched as a/b
+        odd, nested = self.repo("a%b"), self.repo("a/b")
+        self.start()
+        odd_gen, nested_gen = self.want(odd), self.want(nested)
+        self.assertNotEqual(odd_gen, nested_gen)
+        self.assertTrue(wait_for(lambda: odd_gen.exists() and nested_gen.exists()))
+        first = odd_gen.read_text()
+        (odd / "d0" / "f.txt").write_text("changed\n")
+        self.assertTrue(wait_for(lambda: odd_gen.read_text() != first))
+
+    def test_repos_over_budget_are_not_watched_and_lru_is_evicted(self) -> None:
+        big, first, second = self.repo("big", dirs=6), self.repo("first", dirs=2), self.repo("second", dirs=2)
+        self.start("--max-watches", "5")
+        big_gen = self.want(big)
+        first_gen = self.want(first)
+        self.assertTrue(wait_for(first_gen.exists))
+        self.assertFalse(big_gen.exists())
+        os.utime(self.state / "want" / first_gen.name, (1, 1))
+        second_gen = self.want(second)
+        self.assertTrue(wait_for(second_gen.exists))
+        self.assertTrue(wait_for(lambda: not first_gen.exists()))
+
+    def test_exits_and_clears_generations_when_no_shell_remains(self) -> None:
+        root = self.repo("one")
+        self.start()
+        gen = self.want(root)
+        self.assertTrue(wait_for(gen.exists))
+        self.shell.unlink()
+        self.assertEqual(self.proc.wait(timeout=10), 0)
+        self.assertFalse(gen.exists())
+        self.assertFalse((self.state / "watcher.pid").exists())
+
+    def test_second_watcher_exits_immediately(self) -> None:
+        self.start()
+        second = subprocess.run([sys.executable, str(WATCHER), "--state", str(self.state)], timeout=10)
+        self.assertEqual(second.returncode, 0)
+        self.assertIsNone(self.proc.poll())
+
+
+if __name__ == "__main__":
+    unittest.main()
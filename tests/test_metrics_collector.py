@@ -0,0 +1,165 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from typing import Callable
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+COLLECTOR = SCRIPTS / "metrics_collector.py"
+sys.path.insert(0, str(SCRIPTS))
+
+import metrics_collector  # type: ignore # noqa: E402
+
+
+def wait_for(predicate: Callable[[], bool], timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def field(record: bytes, offset: int, width: int) -> str:
+    """Slice as src/collector.zsh does: 1-based offset, trailing blanks dropped."""
+    return record[offset - 1:offset - 1 + width].decode().rstrip()
+
+
+class SamplerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        base = pathlib.Path(self.tmp.name)
+        self.proc = base / "proc"
+        (self.proc / "self").mkdir(parents=True)
+        (self.proc / "loadavg").write_text("0.42 0.30 0.20 1/100 1234\n")
+        (self.proc / "meminfo").write_text("MemTotal: 1000 kB\nMemFree: 100 kB\nMemAvailable: 250 kB\n")
+        (self.proc / "self" / "mounts").write_text(
+            "/dev/root / ext4 rw 0 0\nproc /proc proc rw 0 0\n"
+        )
+        self.power = base / "power"
+        self.supply("BAT0", STATUS="Discharging", ENERGY_NOW=30, ENERGY_FULL=100)
+        self.supply("BAT1", STATUS="Unknown", ENERGY_NOW=90, ENERGY_FULL=100)
+        self.sampler = metrics_collector.Sampler(self.proc, self.power)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def supply(self, name: str, kind: str = "Battery", scope: str = "", **event: object) -> None:
+        """A /sys/class/power_supply entry: type, scope and a uevent file."""
+        path = self.power / name
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "type").write_text(f"{kind}\n")
+        if scope:
+            (path / "scope").write_text(f"{scope}\n")
+        (path / "uevent").write_text("".join(f"POWER_SUPPLY_{key}={value}\n" for key, value in event.items()))
+
+    def test_snapshot_fields_sit_at_the_shell_offsets(self) -> None:
+        (self.proc / "stat").write_text("cpu 100 0 100 800 0 0 0 0 0 0\n")
+        self.sampler.snapshot(0)
+        (self.proc / "stat").write_text("cpu 150 0 150 900 0 0 0 0 0 0\n")
+        record = self.sampler.snapshot(1700000000)
+
+        self.assertEqual(len(record), metrics_collector.SNAPSHOT_SIZE)
+        # Offsets from ZPE_METRICS_LAYOUT in src/collector.zsh
+        self.assertEqual(field(record, 1, 4), "ZPM3")
+        self.assertEqual(field(record, 5, 12), "1700000000")
+        self.assertEqual(field(record, 17, 8), "0.42")
+        self.assertEqual(field(record, 25, 6), "50.0")
+        self.assertEqual(field(record, 31, 6), "75.0")
+        self.assertEqual(field(record, 37, 4), "60")
+        self.assertEqual(field(record, 41, 12), "Discharging")
+        self.assertEqual(field(record, 53, 3), "1")
+        self.assertEqual(field(record, 56, 6), "")
+        slot = metrics_collector.LAYOUT.size + 1
+        self.assertEqual(field(record, slot + 6, 20), str(os.stat("/").st_dev))
+        self.assertEqual(field(record, slot + 26, 102), "/")
+        self.assertNotEqual(field(record, slot, 6), "")
+
+    def test_cpu_is_blank_until_two_samples(self) -> None:
+        (self.proc / "stat").write_text("cpu 1 0 1 8 0 0 0 0\n")
+        self.assertEqual(self.sampler.cpu(), "")
+
+    def test_no_battery_leaves_fields_blank(self) -> None:
+        sampler = metrics_collector.Sampler(self.proc, self.proc / "none")
+        self.assertEqual(sampler.battery(), ("", "", ""))
+
+    def test_discharging_batteries_estimate_minutes_to_empty(self) -> None:
+        for name, power in (("BAT0", 40), ("BAT1", 20)):
+            with (self.power / name / "uevent").open("a") as uevent:
+                uevent.write(f"POWER_SUPPLY_POWER_NOW={power}\n")
+        # 120 µWh left at 60 µW: two hours
+        self.assertEqual(self.sampler.battery(), ("60", "Discharging", "120"))
+
+    def test_batteries_are_found_by_type_not_name(self) -> None:
+        self.supply("AC", kind="Mains", ONLINE=1)
+        self.supply("hidpp_battery_0", scope="Device", STATUS="Discharging", CAPACITY=5)
+        self.supply("CMB0", STATUS="Charging", ENERGY_NOW=0, ENERGY_FULL=100)
+        self.assertEqual(
+            [path.name for path in self.sampler.battery_paths()], ["BAT0", "BAT1", "CMB0"],
+        )
+        self.assertEqual(self.sampler.battery(), ("40", "Charging", ""))
+
+    def test_mixed_units_fall_back_to_capacity(self) -> None:
+        self.supply("BAT0", STATUS="Discharging", CAPACITY=50, ENERGY_NOW=50, ENERGY_FULL=100, POWER_NOW=10)
+        self.supply("BAT1", STATUS="Discharging", CAPACITY=81, CHARGE_NOW=81, CHARGE_FULL=100, CURRENT_NOW=10)
+        # Energy and charge can't be summed: average capacity, no estimate
+        self.assertEqual(self.sampler.battery(), ("66", "Discharging", ""))
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "the collector reads procfs")
+class CollectorProcessTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state = pathlib.Path(self.tmp.name) / "state"
+        self.state.mkdir(mode=0o700)
+        (self.state / "readers").mkdir()
+        self.reader = self.state / "readers" / str(os.getpid())
+        self.reader.write_text("")
+        self.procs = []
+
+    def tearDown(self) -> None:
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        self.tmp.cleanup()
+
+    def start(self, *args: str) -> subprocess.Popen:
+        proc = subprocess.Popen([sys.executable, str(COLLECTOR), "--state", str(self.state), *args])
+        self.procs.append(proc)
+        return proc
+
+    def test_writes_snapshot_and_exits_when_unread(self) -> None:
+        proc = self.start("--interval", "0.2", "--idle", "1")
+        snapshot = self.state / "snapshot"
+        self.assertTrue(wait_for(snapshot.exists))
+        self.assertEqual(snapshot.read_bytes()[:4], b"ZPM3")
+        self.assertEqual(len(snapshot.read_bytes()), metrics_collector.SNAPSHOT_SIZE)
+        # Still read: keeps running
+        for _ in range(6):
+            self.reader.touch()
+            time.sleep(0.2)
+        self.assertIsNone(proc.poll())
+        # No reads for --idle seconds: exits and removes the snapshot
+        self.assertEqual(proc.wait(timeout=10), 0)
+        self.assertFalse(snapshot.exists())
+
+    def test_refuses_a_state_directory_others_can_write(self) -> None:
+        self.state.chmod(0o777)
+        self.assertEqual(self.start("--interval", "0.2").wait(timeout=10), 1)
+        self.assertFalse((self.state / "snapshot").exists())
+
+    def test_second_instance_exits(self) -> None:
+        first = self.start("--interval", "0.2")
+        self.assertTrue(wait_for((self.state / "collector.pid").exists))
+        second = self.start("--interval", "0.2")
+        self.assertEqual(second.wait(timeout=10), 0)
+        self.assertIsNone(first.poll())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,15 @@
 import os
 import pathlib
 import subprocess
+import sys
+import tempfile
 import textwrap
+import time
 import unittest
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 ZPE_SCRIPT = ROOT / "src" / "zpe.zsh"
+LAST_PID = pathlib.Path("/proc/sys/kernel/ns_last_pid")
 
 
 def run_zsh(script: str, extra_env: dict | None = None) -> str:
@@ -27,6 +31,12 @@ def run_zsh(script: str, extra_env: dict | None = None) -> str:
     return result.stdout.strip()
 
 
+def count_spawns(setup: str, block: str, attempts: int = 5) -> int:
+    """Processes created while `block` runs; min over attempts to drop host noise."""
+    script = f"{setup}\ntypeset before=$(<{LAST_PID})\n{block}\ntypeset after=$(<{LAST_PID})\nprint $(( after - before ))"
+    return min(int(run_zsh(script).splitlines()[-1]) for _ in range(attempts))
+
+
 class ModuleTests(unittest.TestCase):
     def test_art_module_uses_frame(self) -> None:
         script = textwrap.dedent(
@@ -37,7 +47,8 @@ class ModuleTests(unittest.TestCase):
             ZPE_ART_FRAMES=("<>")
             ZPE_FRAME_INDEX=0
             ZPE_ENABLE_ANIMATION=false
-            print -- "$(zpe_module_art)"
+            zpe_module_art
+            print -r -- "$REPLY"
             """
         )
         out = run_zsh(script)
@@ -50,26 +61,59 @@ class ModuleTests(unittest.TestCase):
             source "$ZPE_SCRIPT"
             zpe_register_default_modules
             VIRTUAL_ENV="/tmp/.venv-example"
-            print -- "$(zpe_module_venv)"
+            zpe_module_venv
+            print -r -- "$REPLY"
             """
         )
         out = run_zsh(script)
         self.assertIn("venv:.venv-example", out)
 
-    def test_kubectl_module_respects_namespace(self) -> None:
+    def test_kubectl_module_reads_kubeconfig_files_in_merge_order(self) -> None:
         script = textwrap.dedent(
             """
             emulate -L zsh
             source "$ZPE_SCRIPT"
             zpe_register_default_modules
-            function zpe__kubectl_current_context() { print demo-context; }
-            function zpe__kubectl_namespace() { print dev; }
+            dir=$(mktemp -d)
+            print -r -- "apiVersion: v1
+            contexts:
+            - context:
+                cluster: a
+                extensions:
+                - name: not-this
+                  extension: {}
+              name: other
+            - name: \"demo-context\"
+              context:
+                cluster: b
+                namespace: dev  # team namespace
+            users: []" > $dir/first
+            print -r -- "current-context: demo-context
+            contexts:
+              - context:
+                  namespace: shadowed
+                name: demo-context" > $dir/second
+            print -r -- "current-context: ignored" > $dir/third
+            export KUBECONFIG="$dir/missing::$dir/first:$dir/second:$dir/third:$dir/first"
+            function kubectl() { print -u2 "kubectl ran"; }
             ZPE_KUBE_CONF[show_namespace]="true"
-            print -- "$(zpe_module_kubectl)"
+            zpe_module_kubectl
+            print -r -- "$REPLY"
+            ZPE_KUBE_CONF[show_namespace]="false"
+            zpe_module_kubectl
+            print -r -- "$REPLY"
+            ZPE_KUBE_CONF[show_namespace]="true"
+            print -r -- "current-context: other" > $dir/second
+            zpe_module_kubectl
+            print -r -- "$REPLY"
+            rm -rf $dir
             """
         )
-        out = run_zsh(script)
-        self.assertIn("k8s:demo-context/dev", out)
+        out = run_zsh(script).splitlines()
+        self.assertEqual(
+            out,
+            ["%F{magenta}k8s:demo-context/dev%f", "%F{magenta}k8s:demo-context%f", "%F{magenta}k8s:other%f"],
+        )
 
     def test_battery_module_uses_stubbed_status(self) -> None:
         script = textwrap.dedent(
@@ -77,14 +121,412 @@ class ModuleTests(unittest.TestCase):
             emulate -L zsh
             source "$ZPE_SCRIPT"
             zpe_register_default_modules
-            function zpe__battery_percent_and_status() { print -- "42|Charging"; }
+            function zpe__battery_percent_and_status() { REPLY="42|Charging"; }
             ZPE_BATTERY_CONF[show_status]=true
-            print -- "$(zpe_module_battery)"
+            zpe_module_battery
+            print -r -- "$REPLY"
             """
         )
         out = run_zsh(script)
         self.assertIn("bat:42%+", out)
 
+    def test_battery_combines_uevents_and_limits_refresh(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            power = pathlib.Path(tmp)
+            supplies = {
+                "BAT0": ("Battery", "STATUS=Discharging\nENERGY_NOW=30000000\nENERGY_FULL=50000000\nPOWER_NOW=10000000\n"),
+                "BAT1": ("Battery", "STATUS=Unknown\nENERGY_NOW=10000000\nENERGY_FULL=30000000\nPOWER_NOW=0\n"),
+                "AC": ("Mains", "ONLINE=0\n"),
+                "hidpp_battery_0": ("Battery", "SCOPE=Device\nCAPACITY=5\n"),
+            }
+            for name, (kind, uevent) in supplies.items():
+                (power / name).mkdir()
+                (power / name / "type").write_text(kind + "\n")
+                (power / name / "uevent").write_text("".join(f"POWER_SUPPLY_{line}\n" for line in uevent.split()))
+            (power / "hidpp_battery_0" / "scope").write_text("Device\n")
+            script = textwrap.dedent(
+                """
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                zpe__battery_paths
+                print -r -- "paths ${#reply}"
+                ZPE_BATTERY_CONF[show_time_left]=true
+                zpe_module_battery
+                print -r -- "$REPLY"
+                print -l POWER_SUPPLY_STATUS=Charging POWER_SUPPLY_ENERGY_NOW=50000000 \
+                  POWER_SUPPLY_ENERGY_FULL=50000000 >| $ZPE_POWER_SUPPLY_DIR/BAT0/uevent
+                zpe_module_battery
+                print -r -- "cached $REPLY"
+                ZPE_BATTERY_SAMPLED_AT=0
+                zpe__battery_percent_and_status
+                print -r -- "fresh $REPLY"
+                """
+            )
+            out = run_zsh(script, {"ZPE_POWER_SUPPLY_DIR": str(power)})
+        self.assertIn("paths 2", out)
+        # 40 of 80 Wh left, draining at 10 W: 50%, four hours
+        self.assertIn("bat:50%- 4:00", out)
+        self.assertIn("cached %F{cyan}bat:50%- 4:00", out)
+        self.assertIn("fresh 75|Charging|", out)
+
+    def test_git_status_parses_porcelain_v2(self) -> None:
+        script = textwrap.dedent(
+            r"""
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            local raw=""
+            local -a records=(
+              "# branch.oid 0123456789abcdef0123456789abcdef01234567"
+              "# branch.head feature/x"
+              "# branch.upstream origin/feature/x"
+              "# branch.ab +3 -2"
+              "1 M. N... 100644 100644 100644 a b staged.txt"
+              "1 .M N... 100644 100644 100644 a b edited.txt"
+              "1 A. N... 000000 100644 100644 a b new.txt"
+              "1 .D N... 100644 100644 000000 a b gone.txt"
+              "2 R. N... 100644 100644 100644 a b R100 renamed.txt" "old.txt"
+              "u UU N... 100644 100644 100644 100644 a b c both.txt"
+              "? untracked.txt"
+            )
+            raw=${(pj:\0:)records}
+            zpe__git_parse_status "$raw"
+            for key in branch upstream ahead behind added modified deleted staged unstaged untracked conflicted; do
+              print -r -- "$key=${ZPE_GIT_STATUS[$key]}"
+            done
+            """
+        )
+        fields = dict(line.split("=", 1) for line in run_zsh(script).splitlines())
+        self.assertEqual(fields["branch"], "feature/x")
+        self.assertEqual(fields["upstream"], "origin/feature/x")
+        self.assertEqual((fields["ahead"], fields["behind"]), ("3", "2"))
+        self.assertEqual((fields["added"], fields["modified"], fields["deleted"]), ("1", "2", "1"))
+        self.assertEqual((fields["staged"], fields["unstaged"]), ("3", "2"))
+        self.assertEqual((fields["untracked"], fields["conflicted"]), ("1", "1"))
+
+    def test_git_module_reads_real_repository(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            git = ["git", "-C", tmp, "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(git + ["init", "-q", "-b", "trunk"], check=True)
+            pathlib.Path(tmp, "a.txt").write_text("a\n")
+            subprocess.run(git + ["add", "a.txt"], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            pathlib.Path(tmp, "a.txt").write_text("b\n")
+            pathlib.Path(tmp, "b.txt").write_text("b\n")
+            subprocess.run(git + ["add", "b.txt"], check=True)
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                cd {tmp}
+                zpe_module_git
+                print -r -- "$REPLY"
+                """
+            )
+            self.assertIn("git:trunk +1 ~1", run_zsh(script))
+
+    def test_git_cache_hits_skip_git_until_index_changes(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            git = ["git", "-C", tmp, "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(git + ["init", "-q", "-b", "trunk"], check=True)
+            pathlib.Path(tmp, "a.txt").write_text("a\n")
+            subprocess.run(git + ["add", "a.txt"], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                ZPE_GIT_CONF[cache_max_age]=60
+                cd {tmp}
+                zpe_module_git
+                local saved_path=$PATH
+                path=()
+                zpe_module_git
+                print -r -- "cached=$REPLY"
+                PATH=$saved_path
+                print b > b.txt
+                git add b.txt
+                zpe_module_git
+                print -r -- "fresh=$REPLY"
+                print -r -- "hits=${{ZPE_GIT_CACHE_STATS[hits]}} misses=${{ZPE_GIT_CACHE_STATS[misses]}}"
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn("cached=%F{magenta}git:trunk%f", out)
+            self.assertIn("fresh=%F{magenta}git:trunk +1%f", out)
+            self.assertIn("hits=1 misses=2", out)
+
+    def test_git_large_repo_strategies(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            git = ["git", "-C", tmp, "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(git + ["init", "-q", "-b", "trunk"], check=True)
+            for name in "abcde":
+                pathlib.Path(tmp, name).write_text("1\n")
+            subprocess.run(git + ["add", "."], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            for name in "abcd":
+                pathlib.Path(tmp, name).write_text("22\n")
+            pathlib.Path(tmp, "untracked").write_text("u\n")
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                ZPE_GIT_CONF[cache_max_age]=0
+                ZPE_GIT_CONF[large_repo_threshold]=5
+                ZPE_GIT_CONF[large_repo_max_entries]=2
+                cd {tmp}
+                zpe__git_resolve
+                zpe__git_index_entries
+                print -r -- "entries=$REPLY"
+                for strategy in full capped dirty; do
+                  ZPE_GIT_CONF[large_repo_strategy]=$strategy
+                  zpe_module_git
+                  print -r -- "$strategy=$REPLY untracked=${{ZPE_GIT_STATUS[untracked]}}"
+                done
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn("entries=5", out)
+            self.assertIn("full=%F{magenta}git:trunk ~4%f untracked=0", out)
+            self.assertIn("capped=%F{magenta}git:trunk ~2+%f untracked=0", out)
+            self.assertIn("dirty=%F{magenta}git:trunk *%f untracked=0", out)
+
+    def test_git_scope_limits_counts_and_marks_segment(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            git = ["git", "-C", tmp, "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(git + ["init", "-q", "-b", "trunk"], check=True)
+            svc = pathlib.Path(tmp, "services", "foo")
+            (svc / "src").mkdir(parents=True)
+            (svc / "pyproject.toml").write_text("[project]\n")
+            (svc / "src" / "m.py").write_text("1\n")
+            pathlib.Path(tmp, "top.txt").write_text("1\n")
+            subprocess.run(git + ["add", "."], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            (svc / "src" / "m.py").write_text("2\n")
+            pathlib.Path(tmp, "top.txt").write_text("2\n")
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                ZPE_GIT_CONF[cache_max_age]=60
+                cd {svc}/src
+                for scope in repo cwd project; do
+                  ZPE_GIT_CONF[scope]=$scope
+                  zpe_module_git
+                  print -r -- "$scope=$REPLY"
+                done
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn("repo=%F{magenta}git:trunk ~2%f", out)
+            self.assertIn("cwd=%F{magenta}git:trunk ~1 @src%f", out)
+            self.assertIn("project=%F{magenta}git:trunk ~1 @foo%f", out)
+
+            # Entered through a symlink: resolved on the physical path, as git does
+            link = pathlib.Path(tmp, "link")
+            link.symlink_to(svc / "src")
+            out = run_zsh(script.replace(f"cd {svc}/src", f"cd {link}")).splitlines()
+            self.assertIn("repo=%F{magenta}git:trunk ~2%f", out)
+            self.assertIn("cwd=%F{magenta}git:trunk ~1 @src%f", out)
+            self.assertIn("project=%F{magenta}git:trunk ~1 @foo%f", out)
+
+    def test_git_scope_with_pattern_characters_in_the_repo_path(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo = pathlib.Path(tmp, "re[p]o*")
+            svc = repo / "svc"
+            (svc / "src").mkdir(parents=True)
+            (svc / "go.mod").write_text("module x\n")
+            script = textwrap.dedent(
+                """
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                git init -q "$REPO"
+                cd "$REPO/svc/src"
+                zpe__git_resolve
+                for scope in cwd project; do
+                  ZPE_GIT_CONF[scope]=$scope
+                  zpe_tier_reset
+                  zpe__git_scope
+                  print -r -- "$scope=$REPLY"
+                done
+                """
+            )
+            out = run_zsh(script, {"REPO": str(repo)}).splitlines()
+            self.assertIn("cwd=svc/src", out)
+            self.assertIn("project=svc", out)
+
+    def test_git_shows_ahead_behind_and_stash(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            origin, clone = pathlib.Path(tmp, "origin"), pathlib.Path(tmp, "clone")
+            ident = ["-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(["git", "init", "-q", "-b", "main", str(origin)], check=True)
+            subprocess.run(["git", "-C", str(origin), *ident, "commit", "-q", "--allow-empty", "-m", "base"], check=True)
+            subprocess.run(["git", "clone", "-q", str(origin), str(clone)], check=True)
+            for i in range(2):
+                subprocess.run(["git", "-C", str(origin), *ident, "commit", "-q", "--allow-empty", "-m", f"up {i}"], check=True)
+            pathlib.Path(clone, "a.txt").write_text("a\n")
+            subprocess.run(["git", "-C", str(clone), "add", "a.txt"], check=True)
+            subprocess.run(["git", "-C", str(clone), *ident, "commit", "-q", "-m", "local"], check=True)
+            subprocess.run(["git", "-C", str(clone), "fetch", "-q"], check=True)
+            pathlib.Path(clone, "a.txt").write_text("stashed\n")
+            subprocess.run(["git", "-C", str(clone), *ident, "stash", "-q"], check=True)
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                cd {clone}
+                zpe_module_git
+                print -r -- "rev-list=$REPLY"
+                git commit-graph write --reachable
+                ZPE_GIT_AB_CACHE=()
+                zpe_module_git
+                print -r -- "graph=$REPLY"
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn("rev-list=%F{magenta}git:main ⇡1⇣2 ≡1%f", out)
+            self.assertIn("graph=%F{magenta}git:main ⇡1⇣2 ≡1%f", out)
+
+    def test_git_watcher_generation_replaces_cache_age(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            # "%" in the root: the watcher must not take it for a "/"
+            repo = pathlib.Path(tmp, "re%po")
+            git = ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(["git", "init", "-q", "-b", "trunk", str(repo)], check=True)
+            pathlib.Path(repo, "a.txt").write_text("a\n")
+            subprocess.run(git + ["add", "a.txt"], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                ZPE_GIT_WATCH_DIR={tmp}/watch
+                ZPE_GIT_CONF[watcher]=true
+                ZPE_GIT_CONF[cache_max_age]=0
+                zpe_git_watcher_start
+                cd {repo}
+                repeat 100; do
+                  zpe__git_resolve
+                  zpe__git_watch_generation && break
+                  sleep 0.1
+                done
+                zpe_module_git
+                local saved_path=$PATH gen=${{ZPE_GIT_CACHE_GEN[{repo}]}}
+                path=()
+                zpe_module_git
+                print -r -- "watched=$REPLY"
+                PATH=$saved_path
+                print changed > a.txt
+                repeat 100; do
+                  zpe__git_watch_generation && [[ $REPLY != $gen ]] && break
+                  sleep 0.1
+                done
+                zpe_module_git
+                print -r -- "changed=$REPLY hits=${{ZPE_GIT_CACHE_STATS[hits]}}"
+                zpe__git_watcher_detach
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn("watched=%F{magenta}git:trunk%f", out)
+            self.assertIn("changed=%F{magenta}git:trunk ~1%f hits=1", out)
+
+    def test_git_backs_off_to_cached_status_while_index_is_locked(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            git = ["git", "-C", tmp, "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(git + ["init", "-q", "-b", "trunk"], check=True)
+            pathlib.Path(tmp, "a.txt").write_text("a\n")
+            subprocess.run(git + ["add", "a.txt"], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            pathlib.Path(tmp, "a.txt").write_text("b\n")
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                ZPE_GIT_CONF[cache_max_age]=0
+                ZPE_GIT_CONF[read_only]=true
+                cd {tmp}
+                zpe_module_git
+                print -r -- "before=$REPLY"
+                : > .git/index.lock
+                print c > c.txt
+                git add c.txt 2>/dev/null
+                zpe_module_git
+                print -r -- "locked=$REPLY backoffs=${{ZPE_GIT_CACHE_STATS[backoffs]}}"
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn("before=%F{magenta}git:trunk ~1%f", out)
+            self.assertIn("locked=%F{magenta}git:trunk ~1%f backoffs=1", out)
+
+    def test_git_resolver_reads_repository_files_without_git(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            repo = pathlib.Path(tmp).resolve() / "repo"
+            git = ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(["git", "init", "-q", "-b", "trunk", str(repo)], check=True)
+            (repo / "sub").mkdir()
+            (repo / "sub" / "a.txt").write_text("a\n")
+            subprocess.run(git + ["add", "-A"], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            subprocess.run(git + ["pack-refs", "--all"], check=True)
+            subprocess.run(git + ["worktree", "add", "-q", "-b", "side", str(pathlib.Path(tmp) / "wt")], check=True)
+            oid = subprocess.run(git + ["rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                path=()
+                ZPE_GIT_CONF[show_status]=false
+                cd {repo}/sub
+                zpe__git_resolve
+                print -r -- "main=${{ZPE_GIT_REPO[branch]}} ${{ZPE_GIT_REPO[oid]}} ${{ZPE_GIT_REPO[root]}}"
+                cd {tmp}/wt
+                zpe__git_resolve
+                print -r -- "worktree=${{ZPE_GIT_REPO[branch]}} ${{ZPE_GIT_REPO[oid]}}"
+                print -r -- {oid} > {repo}/.git/HEAD
+                print -r -- {oid} > {repo}/.git/MERGE_HEAD
+                cd {repo}
+                zpe_module_git
+                print -r -- "detached=$REPLY"
+                cd {tmp}
+                zpe_module_git
+                print -r -- "outside=$REPLY"
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertIn(f"main=trunk {oid} {repo}", out)
+            self.assertIn(f"worktree=side {oid}", out)
+            self.assertIn(f"detached=%F{{magenta}}git:{oid[:7]}|merge%f", out)
+            self.assertIn("outside=", out)
+
+    def test_git_root_miss_is_retried_after_an_ancestor_git_init(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            base = pathlib.Path(tmp).resolve()
+            (base / "top" / "sub").mkdir(parents=True)
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                cd {base}/top/sub
+                zpe__git_find_root || print before=miss
+                cd ..; git init -q; cd sub
+                zpe__git_find_root && print -r -- "after=${{reply[1]}}"
+                zpe__git_find_root && print -r -- "cached=${{reply[1]}}"
+                """
+            )
+            out = run_zsh(script).splitlines()
+            self.assertEqual(out, ["before=miss", f"after={base}/top", f"cached={base}/top"])
+
     def test_full_prompt_render_with_multiple_modules(self) -> None:
         """Render a full prompt with stubbed modules and verify segments."""
         script = textwrap.dedent(
@@ -94,10 +536,9 @@ class ModuleTests(unittest.TestCase):
             zpe_register_default_modules
 
             # Stub helpers so modules produce predictable output
-            function zpe__git_is_repo() { return 0; }
-            function zpe__git_branch() { print main; }
-            function zpe__git_dirty_counts() { print 1 2 0; }
-            function zpe__kubectl_current_context() { return 1; }  # disabled
+            function zpe__git_resolve() { ZPE_GIT_REPO=(root /repo branch main); }
+            function zpe__git_status_cached() { ZPE_GIT_STATUS=(branch main added 1 modified 2 deleted 0); }
+            function zpe__kubectl_config() { return 1; }  # disabled
             function zpe__battery_percent_and_status() { return 1; }  # disabled
             VIRTUAL_ENV=""
 
@@ -130,6 +571,798 @@ class ModuleTests(unittest.TestCase):
         # Separator variable should be in the rendered PROMPT (joined segments)
         self.assertIn("ZPE_SEPARATOR", out)
 
+    def test_print_protocol_modules_still_render(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            function my_module() { print -n -- "legacy"; }
+            zpe_register_module legacy my_module
+            function my_reply_module() { REPLY="modern"; }
+            zpe_register_module --reply modern my_reply_module
+            typeset -gA ZPE_LEGACY_CONF ZPE_MODERN_CONF
+            ZPE_MODULE_ORDER=(legacy modern)
+            zpe_render_prompt
+            print -r -- "$PROMPT"
+            """
+        )
+        out = run_zsh(script)
+        self.assertIn("legacy", out)
+        self.assertIn("modern", out)
+
+    def test_compiled_render_unrolls_active_modules(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            VIRTUAL_ENV=/tmp/venv
+            ZPE_MODULE_ORDER=(art project venv kubectl)
+            ZPE_MODULES_DISABLED=(project)
+            ZPE_KUBE_CONF[enabled]=false
+            ZPE_ART_FRAMES=(">>")
+            ZPE_SEPARATOR=" :: "
+            zpe_compile_render
+            print -r -- "${functions[zpe_render_compiled]}"
+            print -r -- "---"
+            zpe_render_prompt
+            print -r -- "$PROMPT"
+            """
+        )
+        body, prompt = run_zsh(script).split("---")
+        self.assertIn("zpe_module_art", body)
+        self.assertIn("zpe_module_venv", body)
+        self.assertNotIn("zpe_module_project", body)
+        self.assertNotIn("zpe_module_kubectl", body)
+        self.assertIn(">>%f :: %F{cyan}venv:venv", prompt)
+
+    def test_compile_render_is_noop_when_config_unchanged(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            zpe_compile_render
+            functions[zpe_render_compiled]+=$'\\n: marker'
+            zpe_compile_render
+            [[ ${functions[zpe_render_compiled]} == *marker* ]] && print kept
+            ZPE_MODULE_ORDER=(art)
+            zpe_compile_render
+            [[ ${functions[zpe_render_compiled]} == *marker* ]] || print rebuilt
+            """
+        )
+        self.assertEqual(run_zsh(script).split(), ["kept", "rebuilt"])
+
+    def test_preexec_classifies_commands_per_module(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            for line in "ls -la" "git checkout main" "kubectx prod" "vim notes.txt" \
+                "ls && sudo git pull" "source .venv/bin/activate" "kubectl get pods"; do
+              zpe__classify_command "$line"
+              print -r -- "$line=${(j:,:)${(o)reply}}"
+            done
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("ls -la=", out)
+        self.assertIn("git checkout main=git", out)
+        self.assertIn("kubectx prod=kubectl", out)
+        self.assertIn("vim notes.txt=git", out)
+        self.assertIn("ls && sudo git pull=git", out)
+        self.assertIn("source .venv/bin/activate=venv", out)
+        self.assertIn("kubectl get pods=", out)
+
+    def test_segments_are_reused_until_preexec_marks_them_dirty(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -gi repo_runs=0 clock_runs=0
+            function repo_module() { (( repo_runs++ )); REPLY="repo$repo_runs"; }
+            function clock_module() { (( clock_runs++ )); REPLY="clock$clock_runs"; }
+            zpe_register_module -r repo repo_module
+            zpe_register_module -r clock clock_module
+            typeset -gA ZPE_REPO_CONF ZPE_CLOCK_CONF
+            ZPE_INVALIDATE[repo]="make *"
+            ZPE_INVALIDATE[clock]="*"
+            ZPE_INVALIDATE[unknown]=repo
+            ZPE_MODULE_ORDER=(repo clock)
+            for renderer in compiled generic; do
+              if [[ $renderer == compiled ]]; then zpe_compile_render; else zpe_discard_compiled_render; fi
+              repo_runs=0 clock_runs=0
+              ZPE_SEGMENT_CACHE=()
+              zpe_render_prompt
+              zpe_preexec "ls" "ls" "ls"
+              zpe_render_prompt
+              print -r -- "$renderer after ls: $PROMPT"
+              zpe_preexec "make all" "make all" "make all"
+              zpe_render_prompt
+              print -r -- "$renderer after make: $PROMPT"
+              zpe_preexec "./configure" "./configure" "./configure"
+              zpe_render_prompt
+              print -r -- "$renderer after unknown: $PROMPT"
+            done
+            """
+        )
+        out = run_zsh(script).splitlines()
+        for renderer in ("compiled", "generic"):
+            self.assertIn(f"{renderer} after ls: repo1 | clock2 ", out)
+            self.assertIn(f"{renderer} after make: repo2 | clock3 ", out)
+            self.assertIn(f"{renderer} after unknown: repo3 | clock4 ", out)
+
+    def test_timed_out_module_shows_stale_value_and_backs_off(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -g delay=0
+            function slow_module() { sleep $delay; REPLY="slow:ok"; }
+            zpe_register_module -r slow slow_module
+            typeset -gA ZPE_SLOW_CONF=(timeout_ms 300)
+            ZPE_MODULE_ORDER=(slow)
+            ZPE_STALE_MARKER="?"
+            zpe_compile_render
+            zpe_render_prompt
+            print -r -- "fast: $PROMPT"
+            delay=2
+            start=$EPOCHREALTIME
+            zpe_render_prompt 2>$ZPE_TEST_LOG
+            print -r -- "stale: $PROMPT"
+            print -r -- "waited: $(( EPOCHREALTIME - start < 1.5 ))"
+            zpe_render_prompt
+            print -r -- "fails: ${ZPE_MODULE_FAILS[slow]}"
+            delay=0
+            ZPE_MODULE_RETRY_AT[slow]=0
+            zpe_render_prompt
+            print -r -- "recovered: $PROMPT ${+ZPE_MODULE_FAILS[slow]}"
+            """
+        )
+        with tempfile.NamedTemporaryFile("r", suffix=".log") as log:
+            out = run_zsh(script, {"ZPE_TEST_LOG": log.name}).splitlines()
+            logged = log.read()
+        self.assertIn("fast: slow:ok ", out)
+        self.assertIn("stale: slow:ok%F{white}?%f ", out)
+        self.assertIn("waited: 1", out)
+        self.assertIn("fails: 1", out)
+        self.assertIn("recovered: slow:ok 0", out)
+        self.assertIn("zpe: slow: no result within 300ms", logged)
+
+    def test_timed_module_keeps_its_caches(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -gA SLOW_CACHE
+            typeset -gi SLOW_RUNS=0
+            function slow_module() {
+              (( ++SLOW_RUNS ))
+              [[ -n ${SLOW_CACHE[$PWD]} ]] || SLOW_CACHE[$PWD]="dir ${PWD:t}"
+              REPLY="${SLOW_CACHE[$PWD]}:$SLOW_RUNS"
+            }
+            zpe_register_module -r slow slow_module
+            ZPE_MODULE_STATE[slow]="SLOW_CACHE SLOW_RUNS"
+            typeset -gA ZPE_SLOW_CONF=(timeout_ms 2000)
+            cd /tmp
+            zpe_run_module slow; zpe_run_module slow
+            print -r -- "reply: $REPLY"
+            print -r -- "kept: ${SLOW_CACHE[/tmp]} $SLOW_RUNS"
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("reply: dir tmp:2", out)
+        self.assertIn("kept: dir tmp 2", out)
+
+    def test_shared_store_serves_other_shells_and_revalidates(self) -> None:
+        setup = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            function shared_module() { sleep ${SHARED_DELAY:-0}; print run >> $ZPE_TEST_RUNS; REPLY="shared:$SHARED_INPUT"; }
+            zpe_register_module -r -e SHARED_INPUT shared shared_module
+            ZPE_MODULE_ORDER=(shared)
+            ZPE_SHARED_MODULES=(shared)
+            ZPE_STALE_MARKER="?"
+            zpe_compile_render
+            """
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"ZPE_STORE_DIR": f"{tmp}/store", "ZPE_TEST_RUNS": f"{tmp}/runs", "SHARED_INPUT": "1"}
+            runs = pathlib.Path(tmp) / "runs"
+
+            # Two shells starting together: one computes, the other waits for it
+            both = setup + textwrap.dedent(
+                """
+                SHARED_DELAY=1
+                ( zpe_render_prompt; print -r -- "other: $PROMPT" >| $ZPE_STORE_DIR/../other ) &
+                sleep 0.2
+                zpe_render_prompt
+                wait
+                print -r -- "first: $PROMPT"
+                print -r -- "$(<$ZPE_STORE_DIR/../other)"
+                """
+            )
+            out = run_zsh(both, env).splitlines()
+            self.assertIn("first: shared:1 ", out)
+            self.assertIn("other: shared:1 ", out)
+            self.assertEqual(runs.read_text().count("run"), 1)
+
+            # A new shell takes the stored segment without computing it
+            out = run_zsh(setup + 'zpe_render_prompt; print -r -- "new: $PROMPT"', env)
+            self.assertIn("new: shared:1 ", out)
+            self.assertEqual(runs.read_text().count("run"), 1)
+
+            # Inputs changed: the stored segment is shown stale, then refreshed
+            stale = setup + textwrap.dedent(
+                """
+                zpe_render_prompt
+                print -r -- "stale: $PROMPT"
+                for i in {1..50}; do
+                  sleep 0.1
+                  zpe_render_prompt
+                  [[ $PROMPT == "shared:2 " ]] && break
+                done
+                print -r -- "refreshed: $PROMPT ${ZPE_STORE_STATS[stale]}"
+                """
+            )
+            out = run_zsh(stale, {**env, "SHARED_INPUT": "2"}).splitlines()
+            self.assertIn("stale: shared:1%F{white}?%f ", out)
+            self.assertTrue(any(line.startswith("refreshed: shared:2 ") for line in out), out)
+
+            # Beyond store_size the least recently used entries are evicted
+            evict = setup + textwrap.dedent(
+                """
+                ZPE_STORE_SIZE=2
+                base=$(mktemp -d)
+                for dir in a b c; do
+                  mkdir $base/$dir
+                  cd $base/$dir
+                  zpe_run_module shared
+                done
+                entries=($ZPE_STORE_DIR/entries/*(N))
+                print -r -- "entries: ${#entries} ${entries[(I)*/shared-*]}"
+                """
+            )
+            self.assertIn("entries: 2 2", run_zsh(evict, env))
+
+    def test_daemon_segments_are_spliced_between_local_modules(self) -> None:
+        setup = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            function local_module() { REPLY=local; }
+            zpe_register_module -r here local_module
+            zpe_register_daemon_module hello
+            ZPE_MODULE_ORDER=(here hello)
+            ZPE_DAEMON_ENV=(HELLO_NAME)
+            ZPE_DAEMON_CONF[enabled]=true
+            ZPE_DAEMON_STARTED=$EPOCHSECONDS  # the test starts the daemon itself
+            zpe_compile_render
+            zpe_render_prompt
+            print -r -- "compiled: $PROMPT"
+            zpe_discard_compiled_render
+            zpe_render_prompt
+            print -r -- "generic: $PROMPT"
+            """
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            provider = pathlib.Path(tmp) / "hello.py"
+            provider.write_text(
+                "def register(providers):\n"
+                "    providers.add('hello', lambda request, conf: 'hi:' + request.env.get('HELLO_NAME', '?'),\n"
+                "                  env=('HELLO_NAME',))\n"
+            )
+            config = pathlib.Path(tmp) / "config.toml"
+            config.write_text(f'[daemon]\nproviders = ["{provider}"]\n')
+            sock = pathlib.Path(tmp) / "zpe-daemon.sock"
+            env = {"ZPE_DAEMON_SOCKET": str(sock), "ZPE_CONFIG_PATH": str(config), "HELLO_NAME": "zsh"}
+
+            # No daemon yet: local modules render, the daemon-only one is empty
+            out = run_zsh(setup, env).splitlines()
+            self.assertIn("compiled: local ", out)
+            self.assertIn("generic: local ", out)
+
+            daemon = subprocess.Popen([sys.executable, str(ROOT / "scripts" / "prompt_daemon.py"),
+                                       "--socket", str(sock), "--config", str(config), "--idle", "30"])
+            try:
+                for _ in range(100):
+                    if sock.exists():
+                        break
+                    time.sleep(0.05)
+                out = run_zsh(setup, env).splitlines()
+                self.assertIn("compiled: local | hi:zsh ", out)
+                self.assertIn("generic: local | hi:zsh ", out)
+            finally:
+                daemon.kill()
+                daemon.wait()
+
+    def test_tiers_memoize_per_session_directory_and_prompt(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -gi session_runs=0 dir_runs=0 prompt_runs=0
+            function host_tier() { (( session_runs++ )); REPLY=host; }
+            function name_tier() { (( dir_runs++ )); REPLY=${PWD:t}; }
+            function tick_tier() { (( prompt_runs++ )); REPLY=$prompt_runs; }
+            zpe_register_tier session host host_tier
+            zpe_register_tier directory name name_tier
+            zpe_register_tier prompt tick tick_tier
+            zpe_register_tier hourly bad name_tier || print rejected
+            ZPE_MODULE_ORDER=()
+            ZPE_DIR_CACHE_SIZE=2
+            base=$(mktemp -d)
+            mkdir $base/a $base/b $base/c
+            zpe_install_chpwd
+            zpe__tier_run session
+            for dir in a b a b a b; do
+              cd $base/$dir
+              zpe_precmd
+              zpe_tier name; names+=($REPLY)
+              zpe_tier host
+            done
+            print -r -- "names=${(j:,:)names} dir_runs=$dir_runs"
+            cd $base/c; cd $base/a
+            print -r -- "evicted dir_runs=$dir_runs lru=${#ZPE_DIR_TIER_LRU}"
+            print -r -- "session_runs=$session_runs prompt_runs=$prompt_runs"
+            cd /; rm -rf $base
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("rejected", out)
+        self.assertIn("names=a,b,a,b,a,b dir_runs=2", out)
+        self.assertIn("evicted dir_runs=4 lru=2", out)
+        self.assertIn("session_runs=1 prompt_runs=6", out)
+
+    def test_declared_inputs_reuse_segment_until_fingerprint_changes(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -gi runs=0
+            function tool_module() { (( runs++ )); REPLY="tool:${TOOL_ENV}:$runs"; }
+            tmp=$(mktemp)
+            zpe_register_module -r -e TOOL_ENV -f "$tmp" -d tool tool_module
+            typeset -gA ZPE_TOOL_CONF
+            ZPE_MODULE_ORDER=(tool)
+            zpe_register_module -r -e "bad name" other tool_module || print rejected
+            for renderer in compiled generic; do
+              if [[ $renderer == compiled ]]; then zpe_compile_render; else zpe_discard_compiled_render; fi
+              ZPE_FINGERPRINT=() ZPE_SEGMENT_HITS=() ZPE_SEGMENT_MISSES=()
+              runs=0 TOOL_ENV=a
+              zpe_render_prompt
+              zpe_preexec "make" "make" "make"
+              zpe_render_prompt
+              print -r -- "$renderer same: $PROMPT"
+              TOOL_ENV=b
+              zpe_render_prompt
+              print -r -- "$renderer env: $PROMPT"
+              print -r -- changed >> $tmp
+              zpe_render_prompt
+              print -r -- "$renderer file: $PROMPT"
+              print -r -- "$renderer stats: ${ZPE_SEGMENT_HITS[tool]} ${ZPE_SEGMENT_MISSES[tool]}"
+            done
+            rm -f $tmp
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("rejected", out)
+        for renderer in ("compiled", "generic"):
+            self.assertIn(f"{renderer} same: tool:a:1 ", out)
+            self.assertIn(f"{renderer} env: tool:b:2 ", out)
+            self.assertIn(f"{renderer} file: tool:b:3 ", out)
+            self.assertIn(f"{renderer} stats: 1 3", out)
+
+    def test_cached_segment_is_dropped_when_its_signature_changes(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -g stamp=one
+            typeset -gi runs=0
+            function repo_module() { (( ++runs )); REPLY="repo:$stamp:$runs"; }
+            function repo_signature() { REPLY=$stamp; }
+            zpe_register_module -r repo repo_module
+            ZPE_MODULE_SIGNATURE[repo]=repo_signature
+            ZPE_INVALIDATE[repo]="repotool *"
+            ZPE_MODULE_ORDER=(repo)
+            for renderer in compiled generic; do
+              [[ $renderer == generic ]] && zpe_discard_compiled_render || zpe_compile_render
+              stamp=one runs=0
+              ZPE_SEGMENT_CACHE=()
+              zpe_render_prompt; zpe_render_prompt
+              print -r -- "$renderer same: $PROMPT"
+              # Changed outside this shell: no command dirtied it
+              stamp=two
+              zpe_render_prompt
+              print -r -- "$renderer changed: $PROMPT"
+            done
+            """
+        )
+        out = run_zsh(script).splitlines()
+        for renderer in ("compiled", "generic"):
+            self.assertIn(f"{renderer} same: repo:one:1 ", out)
+            self.assertIn(f"{renderer} changed: repo:two:2 ", out)
+
+    def test_prefetched_segment_used_after_long_command_if_signature_holds(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zmodload zsh/system
+            typeset -g stamp=one
+            function repo_module() { REPLY="repo:${sysparams[pid]}"; }
+            function repo_signature() { REPLY=$stamp; }
+            zpe_register_module -r repo repo_module
+            typeset -gA ZPE_REPO_CONF
+            ZPE_MODULE_SIGNATURE[repo]=repo_signature
+            ZPE_INVALIDATE[repo]="repotool *"
+            ZPE_INVALIDATE[unknown]=repo
+            ZPE_MODULE_ORDER=(repo)
+            ZPE_PREFETCH_MODULES=(repo)
+            function run() {
+              ZPE_PREFETCH_THRESHOLD_MS=$1
+              zpe_preexec "make all" "make all" "make all"
+              sleep 0.3
+              [[ -n $2 ]] && stamp=$2
+              zpe_precmd
+              if [[ $PROMPT == *"repo:$$"* ]]; then print -r -- "$3=shell"; else print -r -- "$3=worker"; fi
+            }
+            zpe_precmd
+            run 0 "" long
+            run 100000 "" short
+            run 0 two changed
+            print -r -- "open=${#ZPE_PREFETCH_FD}"
+            # A command aimed at the module itself starts no worker
+            zpe_preexec "repotool commit" "repotool commit" "repotool commit"
+            print -r -- "direct=${#ZPE_PREFETCH_FD} ${ZPE_SEGMENT_DIRTY[repo]}"
+            function git() { print -r -- "locks=$GIT_OPTIONAL_LOCKS"; }
+            function repo_module() { REPLY=$(git); }
+            zpe_preexec "make all" "make all" "make all"
+            sleep 0.3
+            zpe_prefetch_collect
+            print -r -- "worker ${ZPE_SEGMENT_CACHE[repo]}"
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("direct=0 1", out)
+        self.assertIn("worker locks=0", out)
+        self.assertIn("long=worker", out)
+        self.assertIn("short=shell", out)
+        self.assertIn("changed=shell", out)
+        self.assertIn("open=0", out)
+
+    def test_async_worker_result_is_stored_for_current_dir(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            function slow_module() { REPLY="slow:${PWD:t}"; }
+            zpe_register_module -r slow slow_module
+            typeset -gA ZPE_SLOW_CONF=(mode async)
+            cd /tmp
+            zpe__async_segment slow
+            print -r -- "first=$REPLY"
+            zpe__async_ready ${ZPE_ASYNC_FD[slow]}
+            print -r -- "value=${ZPE_ASYNC_VALUE[slow]}"
+            zpe__async_segment slow
+            print -r -- "second=$REPLY"
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("first=%F{white}…%f", out)
+        self.assertIn("value=slow:tmp", out)
+        self.assertIn("second=slow:tmp", out)
+
+    def test_compiled_render_keeps_async_modules_async(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            function slow_module() { REPLY="slow:${PWD:t}"; }
+            zpe_register_module -r slow slow_module
+            typeset -gA ZPE_SLOW_CONF=(mode async timeout_ms 500)
+            ZPE_MODULE_ORDER=(slow)
+            # zsh -c has no line editor; pretend it does
+            function zpe__async_available() { true; }
+            function zle() { :; }
+            cd /tmp
+            zpe_compile_render
+            zpe_render_compiled
+            print -r -- "first=$PROMPT"
+            zpe__async_ready ${ZPE_ASYNC_FD[slow]}
+            print -r -- "second=$PROMPT"
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertIn("first=%F{white}…%f ", out)
+        self.assertIn("second=slow:tmp ", out)
+
+    def test_async_result_replaces_only_its_segment_and_keeps_state(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            typeset -gi SYNC_RUNS=0
+            typeset -gA SLOW_CACHE
+            function slow_module() { SLOW_CACHE[$PWD]=computed; REPLY="slow:${PWD:t}"; }
+            function sync_module() { (( ++SYNC_RUNS )); REPLY=sync; }
+            zpe_register_module -r slow slow_module
+            zpe_register_module -r other sync_module
+            ZPE_MODULE_STATE[slow]=SLOW_CACHE
+            typeset -gA ZPE_SLOW_CONF=(mode async)
+            ZPE_MODULE_ORDER=(other slow)
+            function zpe__async_available() { true; }
+            function zle() { :; }
+            cd /tmp
+            zpe_render_prompt
+            zpe__async_ready ${ZPE_ASYNC_FD[slow]}
+            print -r -- "prompt=$PROMPT runs=$SYNC_RUNS cache=${SLOW_CACHE[/tmp]}"
+            """
+        )
+        self.assertEqual(run_zsh(script), "prompt=sync | slow:tmp  runs=1 cache=computed")
+
+    def test_async_result_from_previous_dir_is_discarded(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            function slow_module() { REPLY="slow:${PWD:t}"; }
+            zpe_register_module -r slow slow_module
+            cd /tmp
+            zpe__async_spawn slow
+            cd /
+            zpe__async_ready $REPLY
+            print -r -- "value=${ZPE_ASYNC_VALUE[slow]-none}"
+            """
+        )
+        self.assertEqual(run_zsh(script), "value=none")
+
+    def test_system_and_battery_read_the_collector_snapshot(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            ZPE_METRICS_DIR=$(mktemp -d)
+            ZPE_COLLECTOR_CONF=(enabled true interval 2 idle 60)
+            ZPE_METRICS_STARTED=$EPOCHSECONDS  # don't launch a real collector
+            mkdir $ZPE_METRICS_DIR/readers
+            python3 -c '
+            import os, sys, time
+            sys.path.insert(0, sys.argv[1] + "/scripts")
+            import metrics_collector as m
+            f = m.field
+            record = m.LAYOUT.pack(m.MAGIC, f(str(int(time.time())), 12), f("1.50", 8), f("12.5", 6),
+                                   f("40.0", 6), f("55", 4), f("Charging", 12), f("2", 3), f("", 6))
+            # "/" under a device id nothing has, as if the tmp dir were another mount
+            device = str(os.stat(sys.argv[2]).st_dev)
+            slots = [m.MOUNT.pack(f("10.0", 6), f("1", 20), f("/", 102)),
+                     m.MOUNT.pack(f("80.0", 6), f(device, 20), f(sys.argv[2], 102))]
+            slots += [m.MOUNT.pack(f("", 6), f("", 20), f("", 102))] * (m.MAX_MOUNTS - 2)
+            open(sys.argv[2] + "/snapshot", "wb").write(record + b"".join(slots))
+            ' "$ZPE_ROOT" "$ZPE_METRICS_DIR"
+            cd $ZPE_METRICS_DIR
+            ZPE_SYSTEM_CONF+=(show_time false show_cpu true show_mem true show_disk true)
+            zpe_module_system
+            print -r -- "$REPLY"
+            zpe_module_battery
+            print -r -- "$REPLY"
+            [[ -e $ZPE_METRICS_DIR/readers/$$ ]] && print touched
+            cd /; rm -rf $ZPE_METRICS_DIR
+            """
+        )
+        out = run_zsh(script).splitlines()
+        self.assertEqual(out[0], "%F{white}load 1.50 cpu 12.5%% mem 40.0%% disk 80.0%%%f")
+        self.assertEqual(out[1], "%F{cyan}bat:55%+%f")
+        self.assertIn("touched", out)
+
+    def test_disk_is_blank_when_the_mount_of_pwd_was_not_sampled(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            ZPE_METRICS_DIR=$(mktemp -d)
+            ZPE_COLLECTOR_CONF=(enabled true interval 2 idle 60)
+            ZPE_METRICS_STARTED=$EPOCHSECONDS  # don't launch a real collector
+            mkdir $ZPE_METRICS_DIR/readers
+            python3 -c '
+            import sys, time
+            sys.path.insert(0, sys.argv[1] + "/scripts")
+            import metrics_collector as m
+            f = m.field
+            record = m.LAYOUT.pack(m.MAGIC, f(str(int(time.time())), 12), f("1.50", 8), f("", 6),
+                                   f("", 6), f("", 4), f("", 12), f("1", 3), f("", 6))
+            # Only a parent mount, as when $PWD is on NFS or past the slot limit
+            slots = [m.MOUNT.pack(f("10.0", 6), f("1", 20), f("/", 102))]
+            slots += [m.MOUNT.pack(f("", 6), f("", 20), f("", 102))] * (m.MAX_MOUNTS - 1)
+            open(sys.argv[2] + "/snapshot", "wb").write(record + b"".join(slots))
+            ' "$ZPE_ROOT" "$ZPE_METRICS_DIR"
+            cd $ZPE_METRICS_DIR
+            ZPE_SYSTEM_CONF+=(show_time false show_disk true)
+            zpe_module_system
+            print -r -- "$REPLY"
+            cd /; rm -rf $ZPE_METRICS_DIR
+            """
+        )
+        self.assertEqual(run_zsh(script), "%F{white}load 1.50%f")
+
+    def test_collector_snapshot_is_only_trusted_when_private_and_well_formed(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            ZPE_METRICS_DIR=$(mktemp -d)
+            ZPE_COLLECTOR_CONF=(enabled true interval 2 idle 60)
+            ZPE_METRICS_STARTED=$EPOCHSECONDS  # don't launch a real collector
+            mkdir $ZPE_METRICS_DIR/readers
+            python3 -c '
+            import sys, time
+            sys.path.insert(0, sys.argv[1] + "/scripts")
+            import metrics_collector as m
+            f = m.field
+            record = m.LAYOUT.pack(m.MAGIC, f(str(int(time.time())), 12), f("$(id)", 8), f("a[$(id)]", 6),
+                                   f("40.0", 6), f("55", 4), f("$(touch x)", 12), f("1", 3), f("", 6))
+            slots = [m.MOUNT.pack(f("$(id)", 6), f("1", 20), f("/", 102))]
+            slots += [m.MOUNT.pack(f("", 6), f("", 20), f("", 102))] * (m.MAX_MOUNTS - 1)
+            open(sys.argv[2] + "/snapshot", "wb").write(record + b"".join(slots))
+            ' "$ZPE_ROOT" "$ZPE_METRICS_DIR"
+            zpe__metrics_snapshot && print -r -- "load=${ZPE_METRICS[load]} cpu=${ZPE_METRICS[cpu]}" \
+              "mem=${ZPE_METRICS[mem]} bat=${ZPE_METRICS[bat_pct]} status=${ZPE_METRICS[bat_status]}" \
+              "mounts=${#ZPE_METRICS_MOUNTS}"
+            # Others could have written it: not read at all
+            chmod 777 $ZPE_METRICS_DIR
+            zpe__metrics_snapshot || print refused dir
+            chmod 700 $ZPE_METRICS_DIR; chmod 666 $ZPE_METRICS_DIR/snapshot
+            zpe__metrics_snapshot || print refused file
+            rm -rf $ZPE_METRICS_DIR
+            """
+        )
+        self.assertEqual(
+            run_zsh(script).splitlines(),
+            ["load= cpu= mem=40.0 bat=55 status= mounts=0", "refused dir", "refused file"],
+        )
+
+    def test_system_module_uses_time_escape_and_proc_load(self) -> None:
+        script = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            read -r line < /proc/loadavg
+            zpe_module_system
+            [[ $REPLY == "%F{white}%D{%H:%M} load ${line%% *}%f" ]] && print ok
+            """
+        )
+        self.assertEqual(run_zsh(script), "ok")
+
+    @unittest.skipUnless(LAST_PID.exists(), "needs /proc/sys/kernel/ns_last_pid")
+    def test_system_module_forks_nothing(self) -> None:
+        setup = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            ZPE_MODULE_ORDER=(system)
+            zpe_compile_render
+            """
+        )
+        self.assertEqual(count_spawns(setup, "repeat 5 zpe_module_system; repeat 5 zpe_render_prompt"), 0)
+
+    @unittest.skipUnless(LAST_PID.exists(), "needs /proc/sys/kernel/ns_last_pid")
+    def test_render_forks_no_subshells_for_reply_modules(self) -> None:
+        setup = textwrap.dedent(
+            """
+            emulate -L zsh
+            source "$ZPE_SCRIPT"
+            zpe_register_default_modules
+            function zpe__battery_percent_and_status() { REPLY="80|Full"; }
+            VIRTUAL_ENV=/tmp/venv
+            ZPE_MODULE_ORDER=(art project venv battery)
+            """
+        )
+        self.assertEqual(count_spawns(setup, "repeat 5 zpe_render_prompt"), 0)
+
+
+class ConfigLoadTests(unittest.TestCase):
+    def test_warm_start_sources_artifact_without_python(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            config = pathlib.Path(tmp) / "zpe.toml"
+            config.write_text("[prompt]\nseparator = ' :: '\n", encoding="utf-8")
+            env = {"ZPE_CONFIG_PATH": str(config), "ZPE_CACHE_DIR": str(pathlib.Path(tmp) / "cache")}
+            script = textwrap.dedent(
+                """
+                source "$ZPE_SCRIPT"
+                zpe_load_config
+                print -r -- "$ZPE_SEPARATOR"
+                """
+            )
+            # Cold start runs the loader and writes the artifact
+            self.assertEqual(run_zsh(script, env), "::")
+            # Warm start must not need python (or any other command) on PATH
+            warm = "path=()\n" + script
+            self.assertEqual(run_zsh(warm, env), "::")
+
+    def test_same_second_same_size_edit_rebuilds_artifact(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            config = pathlib.Path(tmp) / "zpe.toml"
+            config.write_text("[prompt]\nseparator = ' :: '\n", encoding="utf-8")
+            os.utime(config, ns=(1_700_000_000_100_000_000, 1_700_000_000_100_000_000))
+            env = {"ZPE_CONFIG_PATH": str(config), "ZPE_CACHE_DIR": str(pathlib.Path(tmp) / "cache")}
+            script = 'source "$ZPE_SCRIPT"\nzpe_load_config\nprint -r -- "$ZPE_SEPARATOR"'
+            self.assertEqual(run_zsh(script, env), "::")
+            # Same size, same second, later nanoseconds
+            config.write_text("[prompt]\nseparator = ' ## '\n", encoding="utf-8")
+            os.utime(config, ns=(1_700_000_000_900_000_000, 1_700_000_000_900_000_000))
+            self.assertEqual(run_zsh(script, env), "##")
+
+    def test_default_config_skips_python(self) -> None:
+        script = textwrap.dedent(
+            """
+            path=()
+            source "$ZPE_SCRIPT"
+            zpe_load_config || print failed
+            print -r -- "${ZPE_ART_FRAMES[1]} ${ZPE_GIT_CONF[show_status]}"
+            """
+        )
+        out = run_zsh(script, {"ZPE_CONFIG_PATH": str(ROOT / "config" / "default.toml")})
+        self.assertEqual(out, "<o true")
+
+
+class GitLockTests(unittest.TestCase):
+    COMMITS = 40
+
+    def test_read_only_renders_never_break_concurrent_commits(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            git = ["git", "-C", tmp, "-c", "user.name=t", "-c", "user.email=t@t"]
+            subprocess.run(git + ["init", "-q", "-b", "trunk"], check=True)
+            for i in range(50):
+                pathlib.Path(tmp, f"f{i}.txt").write_text(f"{i}\n")
+            subprocess.run(git + ["add", "."], check=True)
+            subprocess.run(git + ["commit", "-qm", "init"], check=True)
+            stop = pathlib.Path(tmp, ".stop")
+            script = textwrap.dedent(
+                f"""
+                emulate -L zsh
+                source "$ZPE_SCRIPT"
+                zpe_register_default_modules
+                ZPE_GIT_CONF[cache_max_age]=0
+                ZPE_GIT_CONF[read_only]=true
+                cd {tmp}
+                integer renders=0
+                while [[ ! -e {stop} ]]; do
+                  zpe_module_git
+                  (( renders++ ))
+                done
+                print -r -- "renders=$renders backoffs=${{ZPE_GIT_CACHE_STATS[backoffs]}}"
+                """
+            )
+            env = os.environ.copy()
+            env.update({"ZPE_ROOT": str(ROOT), "ZPE_SCRIPT": str(ZPE_SCRIPT)})
+            renderers = [
+                subprocess.Popen(["zsh", "-c", script], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                for _ in range(3)
+            ]
+            failures = []
+            try:
+                for i in range(self.COMMITS):
+                    pathlib.Path(tmp, f"f{i % 50}.txt").write_text(f"change {i}\n")
+                    for step in (["add", "-A"], ["commit", "-qm", f"change {i}"]):
+                        result = subprocess.run(git + step, capture_output=True, text=True)
+                        if result.returncode != 0:
+                            failures.append(result.stderr)
+            finally:
+                stop.write_text("")
+                outputs = [proc.communicate(timeout=60) for proc in renderers]
+
+            self.assertEqual(failures, [])
+            for proc, (stdout, stderr) in zip(renderers, outputs):
+                self.assertEqual(proc.returncode, 0, stderr)
+                self.assertRegex(stdout, r"renders=[1-9]")
+
 
 if __name__ == "__main__":
     unittest.main()
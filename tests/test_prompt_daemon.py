@@ -0,0 +1,235 @@
+import asyncio
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from typing import Callable, List
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+DAEMON = SCRIPTS / "prompt_daemon.py"
+sys.path.insert(0, str(SCRIPTS))
+
+import config_loader  # type: ignore # noqa: E402
+import prompt_daemon  # type: ignore # noqa: E402
+
+
+def wait_for(predicate: Callable[[], bool], timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def encode(pwd: str, modules: List[str], budget_ms: int = 1000, **env: str) -> bytes:
+    """A request as src/daemon.zsh sends it."""
+    fields = ["ZPE1", "config=", f"pwd={pwd}", f"budget_ms={budget_ms}", "modules=" + " ".join(modules)]
+    fields += [f"env.{name}={value}" for name, value in env.items()]
+    return ("\0".join(fields) + "\0\0").encode()
+
+
+class ParseTests(unittest.TestCase):
+    def test_request_fields(self) -> None:
+        request = prompt_daemon.Request.parse(encode("/tmp", ["git", "kubectl"], 250, KUBECONFIG="/a:/b"))
+        self.assertEqual(request.pwd, "/tmp")
+        self.assertEqual(request.modules, ["git", "kubectl"])
+        self.assertEqual(request.budget_ms, 250)
+        self.assertEqual(request.env, {"KUBECONFIG": "/a:/b"})
+
+    def test_rejects_other_protocols(self) -> None:
+        with self.assertRaises(ValueError):
+            prompt_daemon.Request.parse(b"GET / HTTP/1.0\0\0")
+
+    def test_status_counts(self) -> None:
+        out = "\0".join([
+            "1 .M N... 100644 100644 100644 a b file.txt",
+            "1 A. N... 000000 100644 100644 a b new.txt",
+            "2 R. N... 100644 100644 100644 a b R100 renamed.txt", "old.txt",
+            "1 .D N... 100644 100644 000000 a b gone.txt", "",
+        ])
+        self.assertEqual(
+            prompt_daemon.parse_status(out),
+            dict(added=1, modified=1, deleted=1),
+        )
+
+
+class DaemonTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        self.watched = self.dir / "watched"
+        self.watched.write_text("1")
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.delay = 0.2
+        providers = prompt_daemon.Providers()
+        providers.add("slow", self.slow, watch=lambda request: [str(self.watched)])
+        providers.add("never", lambda request, conf: None)
+        self.daemon = prompt_daemon.Daemon(providers, cache_size=4, workers=4)
+        # One loop for the whole test, as in the daemon: in-flight work outlives a request
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.daemon.pool.shutdown(wait=True)
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def slow(self, request: prompt_daemon.Request, conf: prompt_daemon.Config) -> str:
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        return f"slow:{calls}"
+
+    def answer(self, *modules: str, budget_ms: int = 1000) -> List[str]:
+        request = prompt_daemon.Request.parse(encode(str(self.dir), list(modules), budget_ms))
+        return self.loop.run_until_complete(self.daemon.answer(request))
+
+    def test_concurrent_requests_share_one_computation(self) -> None:
+        async def burst() -> List[List[str]]:
+            requests = [prompt_daemon.Request.parse(encode(str(self.dir), ["slow"])) for _ in range(5)]
+            return await asyncio.gather(*(self.daemon.answer(request) for request in requests))
+
+        self.assertEqual(self.loop.run_until_complete(burst()), [["+slow:1"]] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.daemon.stats["coalesced"], 4)
+
+    def test_cached_until_a_watched_file_changes(self) -> None:
+        self.assertEqual(self.answer("slow"), ["+slow:1"])
+        self.assertEqual(self.answer("slow"), ["+slow:1"])
+        self.assertEqual(self.daemon.stats["hits"], 1)
+        self.watched.write_text("22")
+        self.assertEqual(self.answer("slow"), ["+slow:2"])
+
+    def test_unknown_and_declined_modules_are_left_to_the_shell(self) -> None:
+        self.assertEqual(self.answer("nope", "never", "slow"), ["-", "-", "+slow:1"])
+
+    def test_late_result_is_served_stale_then_fresh(self) -> None:
+        self.assertEqual(self.answer("slow"), ["+slow:1"])
+        self.watched.write_text("22")
+        self.delay = 0.5
+        reply = self.answer("slow", budget_ms=100)
+        self.assertTrue(reply[0].startswith("+slow:1%F{"), reply)
+        self.assertTrue(reply[0].endswith("?%f"), reply)
+        self.assertTrue(wait_for(lambda: self.answer("slow", budget_ms=100) == ["+slow:2"]))
+
+    def test_nothing_cached_and_over_budget_is_left_to_the_shell(self) -> None:
+        self.delay = 0.5
+        self.assertEqual(self.answer("slow", budget_ms=100), ["-"])
+
+
+class ProviderTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name).resolve()
+        self.conf = config_loader.merge(config_loader.DEFAULTS, {"kubectl": {"show_namespace": True}})
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def request(self, pwd: pathlib.Path, **env: str) -> prompt_daemon.Request:
+        return prompt_daemon.Request.parse(encode(str(pwd), ["git", "kubectl"], **env))
+
+    @unittest.skipIf(config_loader.yaml is None, "pyyaml is not installed")
+    def test_kubectl_first_file_wins(self) -> None:
+        first, second = self.dir / "a.yaml", self.dir / "b.yaml"
+        first.write_text("contexts:\n- name: prod\n  context:\n    namespace: web\n")
+        second.write_text("current-context: prod\ncontexts:\n- name: prod\n  context:\n    namespace: api\n")
+        request = self.request(self.dir, KUBECONFIG=f"{first}:{second}")
+        self.assertEqual(prompt_daemon.kubectl_segment(request, self.conf), "%F{magenta}k8s:prod/web%f")
+        self.assertEqual(prompt_daemon.kube_files(request), [str(first), str(second)])
+
+    def test_git_segment_and_scope(self) -> None:
+        repo = self.dir / "repo"
+        (repo / "sub").mkdir(parents=True)
+        git = ["git", "-c", "user.name=t", "-c", "user.email=t@t", "-c", "init.defaultBranch=main"]
+        try:
+            subprocess.run(git + ["init", "-q"], cwd=repo, check=True)
+            (repo / "file.txt").write_text("a\n")
+            subprocess.run(git + ["add", "file.txt"], cwd=repo, check=True)
+            subprocess.run(git + ["commit", "-q", "-m", "init"], cwd=repo, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest("git is not available")
+        (repo / "file.txt").write_text("b\n")
+
+        request = self.request(repo / "sub")
+        self.assertEqual(prompt_daemon.git_scope(request), str(repo))
+        self.assertEqual(prompt_daemon.git_segment(request, self.conf), "%F{magenta}git:main ~1%f")
+        self.assertIn(str(repo / ".git" / "index"), prompt_daemon.git_watch(request))
+
+        # Entered through a symlink: found on the physical path, as git does
+        (self.dir / "link").symlink_to(repo / "sub")
+        self.assertEqual(prompt_daemon.git_scope(self.request(self.dir / "link")), str(repo))
+
+        # Options the daemon doesn't implement are left to the shell module
+        conf = config_loader.merge(self.conf, {"git": {"engine": "index"}})
+        self.assertIsNone(prompt_daemon.git_segment(request, conf))
+
+        # Ahead of a local upstream: the bounded walk, "+" when it was cut short
+        subprocess.run(git + ["branch", "base"], cwd=repo, check=True)
+        subprocess.run(git + ["config", "branch.main.remote", "."], cwd=repo, check=True)
+        subprocess.run(git + ["config", "branch.main.merge", "refs/heads/base"], cwd=repo, check=True)
+        for message in ("two", "three"):
+            subprocess.run(git + ["commit", "-qam", message], cwd=repo, check=True)
+            (repo / "file.txt").write_text(message)
+        subprocess.run(git + ["commit-graph", "write", "--reachable"], cwd=repo, check=True)
+        conf = config_loader.merge(self.conf, {"git": {"show_status": False, "show_ahead_behind": True}})
+        request = self.request(repo)
+        self.assertEqual(prompt_daemon.git_segment(request, conf), "%F{magenta}git:main ⇡2%f")
+        conf = config_loader.merge(conf, {"git": {"ahead_behind_max_walk": 1}})
+        self.assertEqual(prompt_daemon.git_segment(request, conf), "%F{magenta}git:main ⇡1+%f")
+
+
+class DaemonProcessTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket = pathlib.Path(self.tmp.name) / "run" / "zpe-daemon.sock"
+        self.procs = []
+
+    def tearDown(self) -> None:
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        self.tmp.cleanup()
+
+    def start(self, *args: str) -> subprocess.Popen:
+        proc = subprocess.Popen([sys.executable, str(DAEMON), "--socket", str(self.socket), *args])
+        self.procs.append(proc)
+        return proc
+
+    def ask(self, data: bytes) -> bytes:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(10)
+            conn.connect(str(self.socket))
+            conn.sendall(data)
+            chunks = []
+            while chunk := conn.recv(4096):
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    def test_answers_over_the_socket_and_exits_when_idle(self) -> None:
+        proc = self.start("--idle", "2")
+        self.assertTrue(wait_for(self.socket.exists))
+        self.assertEqual(os.stat(self.socket).st_mode & 0o777, 0o600)
+        self.assertEqual(self.ask(encode(self.tmp.name, ["nope", "git"])), b"-\0+\0")
+        self.assertEqual(proc.wait(timeout=15), 0)
+        self.assertFalse(self.socket.exists())
+
+    def test_second_instance_exits(self) -> None:
+        first = self.start()
+        self.assertTrue(wait_for(self.socket.exists))
+        second = self.start()
+        self.assertEqual(second.wait(timeout=10), 0)
+        self.assertIsNone(first.poll())
+
+
+if __name__ == "__main__":
+    unittest.main()